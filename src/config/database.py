@@ -1,16 +1,45 @@
 import os
 import logging
+from functools import lru_cache
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
 from dotenv import load_dotenv
 
-load_dotenv()
+@lru_cache(maxsize=1)
+def _load_env():
+    """Lee el archivo .env una sola vez por proceso"""
+    load_dotenv()
+
+# Engine compartido por todo el proceso: un único pool de conexiones
+_ENGINE = None
+
+def get_shared_engine(connection_string):
+    """Retorna el engine del proceso, creándolo en la primera llamada"""
+    global _ENGINE
+    if _ENGINE is None:
+        _ENGINE = create_engine(
+            connection_string,
+            pool_size=25,
+            max_overflow=25,
+            pool_pre_ping=True,  # Descarta conexiones muertas antes de usarlas
+            pool_recycle=1800,  # Renueva conexiones cada 30 minutos
+            echo=False  # Cambiar a True para debug
+        )
+    return _ENGINE
+
+def dispose_shared_engine():
+    """Cierra el pool compartido; usar solo al terminar el proceso"""
+    global _ENGINE
+    if _ENGINE is not None:
+        _ENGINE.dispose()
+        _ENGINE = None
 
 class DatabaseConfig:
     """Configuración de la base de datos usando SQLAlchemy"""
     
     def __init__(self):
+        _load_env()
         self.host = os.getenv('DB_HOST')
         self.port = os.getenv('DB_PORT')
         self.database = os.getenv('DB_NAME')
@@ -41,12 +70,7 @@ class DatabaseConnection:
         """Establece conexión con la base de datos"""
         try:
             connection_string = self.config.get_connection_string()
-            self._engine = create_engine(
-                connection_string,
-                pool_size=10,
-                max_overflow=20,
-                echo=False  # Cambiar a True para debug
-            )
+            self._engine = get_shared_engine(connection_string)
             
             # Probar la conexión
             with self._engine.connect() as conn:
@@ -60,9 +84,10 @@ class DatabaseConnection:
             raise
     
     def close(self):
-        """Cierra la conexión"""
+        """Libera la conexión; el pool compartido sigue disponible para otros usuarios"""
         if self._engine:
-            self._engine.dispose()
+            self._engine = None
+            self._session_factory = None
             self.logger.info("Conexión a la base de datos cerrada")
     
     def get_session(self):
@@ -1,56 +1,182 @@
-import logging
 import sys
 import os
-from datetime import datetime
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from src.config.database import DatabaseConnection
+from src.config.database import DatabaseConnection, dispose_shared_engine
 from src.models.repositories import DataRepository
 from src.services.data_loader import SimpleDataLoader
 from src.services.data_processor import SimpleDataProcessor
-from src.utils.logger import setup_logger
+from src.utils.logger import setup_logger, timed
+
+# Filas por bloque leído y por lote procesado: los ids de dimensiones ya
+# están en caché, así que bloques grandes solo reducen viajes a la base
+CHUNK_SIZE = 50000
+
+# Bloques leídos por adelantado mientras la base escribe el actual
+PREFETCH_CHUNKS = 2
+
+# Migraciones independientes entre sí (tocan tablas de hechos distintas): tipo -> método
+MIGRACIONES = {
+    'precios_marginales': 'migrar_precios',
+    'retiros_energia': 'migrar_retiros',
+}
+
+# Tabla de hechos que escribe cada migración
+TABLAS_HECHOS = {
+    'precios_marginales': 'costo_marginal',
+    'retiros_energia': 'retiro_energia',
+}
+
+def _prefetch(iterable, depth=PREFETCH_CHUNKS):
+    """Recorre `iterable` en un hilo aparte, con hasta `depth` elementos preparados de antemano"""
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    fin = object()
+    
+    def put(item):
+        # Espera con plazo y revisa `stop` en cada intento: si el consumidor ya
+        # no va a leer, el productor se entera en a lo sumo 0.1 s
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def producer():
+        source = iter(iterable)
+        try:
+            for item in source:
+                if stop.is_set() or not put((item, None)):
+                    return
+            put((fin, None))
+        except Exception as e:
+            put((fin, e))
+        finally:
+            # El generador se cierra en el hilo que lo recorre: libera de inmediato el
+            # archivo y el pool de validación en vez de esperar al recolector
+            close = getattr(source, 'close', None)
+            if close is not None:
+                close()
+    
+    thread = threading.Thread(target=producer, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is fin:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
 
 class SimpleMigracionApp:
     """Aplicación simplificada de migración de datos"""
     
-    def __init__(self):
+    def __init__(self, validation_workers=None):
         self.logger = setup_logger(__name__)
         self.db_connection = DatabaseConnection()
         self.data_repository = DataRepository(self.db_connection)
-        self.data_loader = SimpleDataLoader()
-        self.data_processor = SimpleDataProcessor(self.data_repository)
+        self.data_loader = SimpleDataLoader(validation_workers=validation_workers)
+        self.data_processor = SimpleDataProcessor(self.data_repository, batch_size=CHUNK_SIZE)
     
+    def migrar_precios(self, file_path, session=None) -> int:
+        """Carga y migra el archivo de precios marginales por bloques"""
+        self.logger.info("=== MIGRANDO PRECIOS MARGINALES ===")
+        count_precios = 0
+        
+        # Igual que retiros: se lee, valida e inserta un bloque a la vez
+        with timed("Precios marginales migrados", self.logger):
+            for chunk in _prefetch(self.data_loader.iter_precios_marginales(file_path, CHUNK_SIZE)):
+                if chunk:
+                    count_precios += self.data_processor.process_precios_marginales(chunk, session=session)
+        
+        self.logger.info(f"Precios marginales migrados: {count_precios} registros")
+        return count_precios
+    
+    def migrar_retiros(self, file_path, session=None) -> int:
+        """Carga y migra el archivo de retiros de energía por bloques"""
+        self.logger.info("=== MIGRANDO RETIROS DE ENERGÍA ===")
+        count_retiros = 0
+        
+        # Lectura y carga por bloques: la memoria depende del bloque y no del
+        # tamaño del archivo, y el siguiente bloque se lee en otro hilo mientras
+        # la base escribe el actual (psycopg2 libera el GIL durante la espera)
+        with timed("Retiros de energía migrados", self.logger):
+            for chunk in _prefetch(self.data_loader.iter_retiros_energia(file_path, CHUNK_SIZE)):
+                if chunk:
+                    count_retiros += self.data_processor.process_retiros_energia(chunk, session=session)
+        
+        self.logger.info(f"Retiros de energía migrados: {count_retiros} registros")
+        return count_retiros
+   
    # En tu función main o donde procesas los retiros
-    def run_migracion(self, archivos_config):
+    def run_migracion(self, archivos_config, parallel=False):
         try:
             self.logger.info("Iniciando proceso de migración simplificado...")
+            self.data_repository.ensure_unique_indexes()
             
-            self.logger.info("=== MIGRANDO PRECIOS MARGINALES ===")
-            data_precios = self.data_loader.load_precios_marginales(archivos_config['precios_marginales'])
-            self.logger.info(f"Precios marginales cargados: {len(data_precios)} registros")
-            
-            if data_precios:
-                count_precios = self.data_processor.process_precios_marginales(data_precios)
-                self.logger.info(f"Precios marginales migrados: {count_precios} registros")
+            if parallel:
+                self._run_migracion_paralela(archivos_config)
+                return
             
-            self.logger.info("=== MIGRANDO RETIROS DE ENERGÍA ===")
-            # Agregar timing
-            start_time = datetime.now()
-            data_retiros = self.data_loader.load_retiros_energia(archivos_config['retiros_energia'])
-            load_time = datetime.now() - start_time
-            self.logger.info(f"Retiros de energía cargados en {load_time}: {len(data_retiros)} registros")
-            
-            if data_retiros:
-                start_time = datetime.now()
-                count_retiros = self.data_processor.process_retiros_energia(data_retiros)
-                process_time = datetime.now() - start_time
-                self.logger.info(f"Retiros de energía migrados en {process_time}: {count_retiros} registros")
+            # Una sola transacción para toda la migración: un único COMMIT al final
+            with self.data_repository.migration_transaction() as session:
+                # Sin índices secundarios durante la carga; se reconstruyen una vez al final.
+                # Solo en las tablas que esta migración escribe
+                indexdefs = self.data_repository.drop_secondary_indexes(session, list(TABLAS_HECHOS.values()))
+                
+                self.migrar_precios(archivos_config['precios_marginales'], session=session)
+                self.migrar_retiros(archivos_config['retiros_energia'], session=session)
+                
+                with timed("Índices secundarios recreados", self.logger):
+                    self.data_repository.restore_indexes(session, indexdefs)
             
         except Exception as e:
             self.logger.error(f"Error en el proceso de migración: {e}")
             raise
     
+    def _run_migracion_paralela(self, archivos_config):
+        """Migra cada archivo en su propio proceso, con conexión y transacciones propias"""
+        tareas = {tipo: archivos_config.get(tipo) for tipo in MIGRACIONES if archivos_config.get(tipo)}
+        if not tareas:
+            self.logger.warning("No hay archivos para migrar")
+            return
+        
+        # Con --validacion-paralela los núcleos se reparten entre los archivos en curso
+        validation_workers = self.data_loader.validation_workers
+        if validation_workers:
+            validation_workers = max(1, validation_workers // len(tareas))
+        
+        # spawn: cada proceso crea su propio engine en lugar de heredar los sockets del pool
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=len(tareas), mp_context=context) as executor:
+            futures = {
+                tipo: executor.submit(_migrar_archivo, tipo, file_path, validation_workers)
+                for tipo, file_path in tareas.items()
+            }
+            for tipo, future in futures.items():
+                self.logger.info(f"Archivo {tipo} migrado en paralelo: {future.result()} registros")
+
+def _migrar_archivo(tipo, file_path, validation_workers=None):
+    """Punto de entrada de cada proceso del modo paralelo"""
+    # Sin sesión compartida cada lote confirma por separado, así los bloqueos
+    # sobre barra y dim_tiempo duran poco y los procesos no se esperan entre sí
+    app = SimpleMigracionApp(validation_workers=validation_workers)
+    try:
+        return getattr(app, MIGRACIONES[tipo])(file_path)
+    finally:
+        dispose_shared_engine()
+
 def main():
     """Función principal simplificada"""
     
@@ -67,9 +193,13 @@ def main():
             print(f"Advertencia: Archivo no encontrado - {archivo}")
             archivos_config[tipo] = None
     
-    # Ejecutar migración
-    app = SimpleMigracionApp()
-    app.run_migracion(archivos_config)
+    # Ejecutar migración (--paralelo: un proceso por archivo;
+    # --validacion-paralela: los bloques se validan en todos los núcleos)
+    app = SimpleMigracionApp(validation_workers=os.cpu_count() if '--validacion-paralela' in sys.argv else None)
+    try:
+        app.run_migracion(archivos_config, parallel='--paralelo' in sys.argv)
+    finally:
+        dispose_shared_engine()
 
 if __name__ == "__main__":
     main()
@@ -2,13 +2,13 @@ from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Barra:
     id_barra: int
     nombre: str
     created_at: datetime
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class DimTiempo:
     id_tiempo: int
     fecha: datetime
@@ -18,7 +18,7 @@ class DimTiempo:
     clave_anio_mes: str
     created_at: datetime
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class PrecioMarginal:
     id_pr_mrgl: int
     tiempo_id: int
@@ -28,7 +28,7 @@ class PrecioMarginal:
     usd: float
     created_at: datetime
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class RetiroEnergia:
     id_rt: int
     tiempo_id: int
@@ -41,7 +41,7 @@ class RetiroEnergia:
     medida_kwh: float
     created_at: datetime
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ContratoFisico:
     id_ct: int
     tiempo_id: int
@@ -55,7 +55,7 @@ class ContratoFisico:
     cmg_peso_kwh: float
     created_at: datetime
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class TipoTransaccion:
     id_tip_trans: int
     nombre: str
@@ -1,350 +1,556 @@
+import csv
+import io
 import logging
-from typing import List, Dict, Any
+import numbers
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
+from typing import List, Dict, Any, Iterable, Iterator
 from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
+import psycopg2
 from datetime import datetime
 import pandas as pd
 
-class BarraRepository:
-    """Repositorio para operaciones de la tabla barra"""
+# Lotes con menos filas que este umbral se insertan con INSERT en vez de COPY
+COPY_MIN_ROWS = 1024
+
+class _CopyNull(float):
+    """Marca de NULL para COPY CSV: el writer la trata como número (sin comillas) y la escribe vacía"""
+    __slots__ = ()
+    
+    def __repr__(self):
+        return ''
+    
+    __str__ = __repr__
+
+# En COPY CSV solo un campo vacío sin comillas es NULL; con QUOTE_NONNUMERIC todo
+# texto va entre comillas, así '' y '\N' se guardan tal cual, igual que con unnest
+_COPY_NULL = _CopyNull()
+
+# Índice único que necesita cada upsert ON CONFLICT de las dimensiones: tabla -> (nombre, columnas)
+DIM_UNIQUE_INDEXES = {
+    'barra': ('ux_barra_nombre', ['nombre']),
+    'dim_tiempo': ('ux_dim_tiempo_fecha_hora_minuto', ['fecha', 'hora', 'minuto']),
+}
+
+def _parse_yymm(texto):
+    """2410 -> 2024-10-01"""
+    return datetime.strptime(texto + '01', '%y%m%d').date()
+
+def _parse_yymmdd(texto):
+    """241001 -> 2024-10-01"""
+    return datetime.strptime(texto, '%y%m%d').date()
+
+def _parse_ymd(texto):
+    """Caso especial de 3 dígitos: se antepone un 0 y se lee como YYMMDD"""
+    return datetime.strptime('0' + texto, '%y%m%d').date()
+
+# Parser por (tipo de origen, largo del texto); lo que no está aquí pasa por pd.to_datetime
+_FECHA_PARSERS = {
+    (str, 4): _parse_yymm,
+    (str, 6): _parse_yymmdd,
+    (int, 4): _parse_yymm,
+    (int, 3): _parse_ymd,
+}
+
+_logger = logging.getLogger(__name__)
+
+def _parse_fecha_problematica(fecha_str):
+    """Parse fechas en formatos problemáticos como 2410, memorizando los valores ya vistos"""
+    # None, NaN y NaT se resuelven antes de la caché: NaN nunca es igual a sí
+    # mismo y cada celda vacía agregaría una entrada nueva
+    try:
+        if pd.isna(fecha_str):
+            return None
+    except (TypeError, ValueError):  # Valores tipo lista: pd.isna no entrega un escalar
+        pass
+    try:
+        return _parse_fecha_cached(fecha_str)
+    except TypeError:  # Valor no hashable: se parsea sin caché
+        return _parse_fecha_sin_cache(fecha_str)
+
+@lru_cache(maxsize=1 << 17)
+def _parse_fecha_cached(fecha_str):
+    """_parse_fecha_sin_cache con caché acotada: la memoria no crece con los valores distintos del archivo"""
+    return _parse_fecha_sin_cache(fecha_str)
+
+def _parse_fecha_sin_cache(fecha_str):
+    """Parse fechas en formatos problemáticos como 2410"""
+    try:
+        if isinstance(fecha_str, str):
+            texto = fecha_str.strip()
+            clave = (str, len(texto)) if texto.isdigit() else None
+        # Si es un número como 2410, asumimos YYMM y agregar día 01; numbers.Real
+        # incluye los escalares de numpy que entrega Series.unique()
+        elif isinstance(fecha_str, numbers.Real):
+            if not 100 <= fecha_str <= 9999:
+                return None
+            texto = str(int(fecha_str))
+            clave = (int, len(texto))
+        # Si ya es datetime o Timestamp
+        elif isinstance(fecha_str, datetime):
+            return fecha_str.date()
+        else:
+            return None
+        
+        # Una búsqueda en la tabla en lugar de la cascada de formatos
+        parser = _FECHA_PARSERS.get(clave)
+        if parser:
+            return parser(texto)
+        
+        # Formato estándar
+        return pd.to_datetime(texto).date()
+    
+    except Exception as e:
+        _logger.warning("No se pudo parsear la fecha: %s. Error: %s", fecha_str, e)
+        return None
+
+class BaseRepository:
+    """Base común: conexión, logger y manejo de sesión propia o compartida"""
     
     def __init__(self, db_connection):
         self.db = db_connection
         self.logger = logging.getLogger(__name__)
     
-    def insert_or_get_barras(self, barras_names: List[str]) -> Dict[str, int]:
-        """Inserta barras nuevas y retorna mapeo nombre -> id"""
+    @contextmanager
+    def _session_scope(self, session=None):
+        """Usa la sesión recibida (sin confirmarla) o abre una propia que se confirma y cierra al salir"""
+        if session is not None:
+            yield session
+            return
+        
         session = self.db.get_session()
         try:
-            # Obtener barras existentes
-            placeholders = ', '.join([':name' + str(i) for i in range(len(barras_names))])
-            params = {'name' + str(i): name for i, name in enumerate(barras_names)}
-            
-            query = f"SELECT id_barra, nombre FROM barra WHERE nombre IN ({placeholders})"
-            result = session.execute(text(query), params)
-            
-            # Accedemos por posición en lugar de por nombre de columna
-            existing_barras = {row[1]: row[0] for row in result}
-            
-            # Insertar nuevas barras
-            new_barras = set(barras_names) - set(existing_barras.keys())
-            barras_map = existing_barras.copy()
-            
-            for barra_name in new_barras:
-                result = session.execute(
-                    text("INSERT INTO barra (nombre) VALUES (:nombre) RETURNING id_barra"),
-                    {'nombre': barra_name}
-                )
-                barra_id = result.scalar()
-                barras_map[barra_name] = barra_id
-                self.logger.info(f"Barra insertada: {barra_name} (ID: {barra_id})")
-            
+            yield session
             session.commit()
-            return barras_map
-            
-        except SQLAlchemyError as e:
+        except Exception:
             session.rollback()
-            self.logger.error(f"Error en insert_or_get_barras: {e}")
             raise
         finally:
             session.close()
 
-class TiempoRepository:
-    """Repositorio para operaciones de la tabla dim_tiempo"""
+class BarraRepository(BaseRepository):
+    """Repositorio para operaciones de la tabla barra"""
     
     def __init__(self, db_connection):
-        self.db = db_connection
-        self.logger = logging.getLogger(__name__)
+        super().__init__(db_connection)
+        # Caché del proceso nombre -> id_barra para no volver a consultar barras ya resueltas
+        self._barra_cache: Dict[str, int] = {}
+        # Upsert en una sola sentencia: el DO UPDATE (sin efecto) hace que
+        # RETURNING también entregue las barras que ya existían
+        self._upsert_stmt = text("""
+            INSERT INTO barra (nombre)
+            SELECT nombre FROM unnest(CAST(:names AS text[])) AS n(nombre)
+            ORDER BY nombre
+            ON CONFLICT (nombre) DO UPDATE SET nombre = EXCLUDED.nombre
+            RETURNING id_barra, nombre
+        """)
     
-    def insert_or_get_tiempos(self, tiempos_data: List[Dict[str, Any]]) -> Dict[tuple, int]:
-        """Inserta tiempos nuevos y retorna mapeo (fecha, hora, minuto) -> id"""
-        session = self.db.get_session()
+    def insert_or_get_barras(self, barras_names: List[str], session=None) -> Dict[str, int]:
+        """Inserta barras nuevas y retorna mapeo nombre -> id"""
+        if not barras_names:
+            return {}
         try:
-            # Crear tuplas para búsqueda
-            tiempo_tuples = [(data['fecha'], data['hora'], data['minuto']) for data in tiempos_data]
-            
-            # Estrategia 1: Buscar en lotes para evitar MemoryError
-            tiempos_map = self._get_existing_tiempos_batch(session, tiempo_tuples)
-            
-            # Identifica nuevos tiempos a insertar
-            new_tiempos = [data for data in tiempos_data
-                           if (data['fecha'], data['hora'], data['minuto']) not in tiempos_map]
-            
-            # Insertar nuevos tiempos
-            if new_tiempos:
-                nuevos_ids = self._insert_new_tiempos_batch(session, new_tiempos)
-                tiempos_map.update(nuevos_ids)
-            
-            session.commit()
-            self.logger.info(f"Procesados {len(tiempos_data)} tiempos: {len(tiempos_map)} existentes,  nuevos: {len(new_tiempos)}")
-            return tiempos_map
+            # Solo viajan a la base los nombres que aún no están en caché;
+            # nombres únicos en el cliente: menos datos enviados y sin DISTINCT en el servidor
+            unknown = list(set(barras_names) - self._barra_cache.keys())
+            if unknown:
+                with self._session_scope(session) as session:
+                    result = session.execute(self._upsert_stmt, {'names': unknown})
+                    
+                    # Filas como tuplas: se desempaquetan por posición, sin construir dicts
+                    nuevos = {nombre: id_barra for id_barra, nombre in result}
+                # A la caché solo después de confirmar (si la sesión era propia)
+                self._barra_cache.update(nuevos)
             
+            # Como antes del caché, un nombre que RETURNING no devolvió igual (espacios,
+            # collation) queda fuera del mapeo y sus filas se omiten, sin abortar la migración
+            cache = self._barra_cache
+            barras_map = {nombre: cache[nombre] for nombre in barras_names if nombre in cache}
+            faltantes = [nombre for nombre in dict.fromkeys(barras_names) if nombre not in barras_map]
+            if faltantes:
+                self.logger.warning("Barras sin id tras el upsert (%d): %s", len(faltantes), faltantes[:10])
+            self.logger.debug("Barras procesadas: %d (%d consultadas)", len(barras_map), len(unknown))
+            return barras_map
+        
         except SQLAlchemyError as e:
-            session.rollback()
-            self.logger.error(f"Error en insert_or_get_tiempos: {e}")
+            self.logger.error("Error en insert_or_get_barras: %s", e)
             raise
-        finally:
-            session.close()
     
-    def _get_existing_tiempos_batch(self, session, tiempo_tuples: List[tuple]) -> Dict[tuple, int]:
-        """Busca tiempos existentes en lotes"""
-        if not tiempo_tuples:
+    def clear_cache(self):
+        """Descarta los ids en caché (p. ej. tras un rollback que deshizo inserciones)"""
+        self._barra_cache.clear()
+
+class TiempoRepository(BaseRepository):
+    """Repositorio para operaciones de la tabla dim_tiempo"""
+    
+    def __init__(self, db_connection):
+        super().__init__(db_connection)
+        # Caché del proceso (fecha, hora, minuto) -> id_tiempo
+        self._tiempo_cache: Dict[tuple, int] = {}
+        # Las claves llegan sin repetir (el DO UPDATE no toca la misma fila dos veces);
+        # el ORDER BY fija un orden de bloqueo estable entre procesos concurrentes
+        self._upsert_stmt = text("""
+            INSERT INTO dim_tiempo (fecha, hora, minuto, cuarto_hora, clave_anio_mes)
+            SELECT *
+            FROM unnest(
+                CAST(:fechas AS date[]),
+                CAST(:horas AS integer[]),
+                CAST(:minutos AS integer[]),
+                CAST(:cuartos_hora AS integer[]),
+                CAST(:claves_anio_mes AS text[])
+            ) AS t(fecha, hora, minuto, cuarto_hora, clave_anio_mes)
+            ORDER BY fecha, hora, minuto
+            ON CONFLICT (fecha, hora, minuto) DO UPDATE SET fecha = EXCLUDED.fecha
+            RETURNING id_tiempo, fecha, hora, minuto
+        """)
+    
+    def insert_or_get_tiempos(self, tiempos_data: List[Dict[str, Any]], session=None) -> Dict[tuple, int]:
+        """Inserta tiempos nuevos y retorna mapeo (fecha, hora, minuto) -> id"""
+        if not tiempos_data:
             return {}
         try:
-            # Crear tabla temporal con los datos a buscar
-            temp_table_query = """
-                CREATE TEMP TABLE IF NOT EXISTS temp_tiempos_search (
-                    fecha DATE,
-                    hora INTEGER,
-                    minuto INTEGER
-                ) ON COMMIT DROP
-            """
-            session.execute(text(temp_table_query))
+            keys = [(t['fecha'], t['hora'], t['minuto']) for t in tiempos_data]
             
-            # Insertar datos en la tabla temporal
-            insert_temp_query = "INSERT INTO temp_tiempos_search (fecha, hora, minuto) VALUES (:fecha, :hora, :minuto)"
-                
-            # Insertar en lotes para mejor performance
-            batch_size = 1000
-            for i in range(0, len(tiempo_tuples), batch_size):
-                batch = tiempo_tuples[i:i + batch_size]
-                params = [{'fecha': fecha, 'hora': hora, 'minuto': minuto} 
-                        for fecha, hora, minuto in batch]
-                session.execute(text(insert_temp_query), params)
+            # Solo se inserta o consulta lo que aún no está en caché, una vez por
+            # (fecha, hora, minuto) aunque la clave se repita en el lote; la
+            # diferencia de claves se resuelve en C y no con un filtro por fila
+            by_key = dict(zip(keys, tiempos_data))
+            pending = [by_key[key] for key in by_key.keys() - self._tiempo_cache.keys()]
+            if pending:
+                with self._session_scope(session) as session:
+                    nuevos = self._upsert_tiempos(session, pending)
+                # A la caché solo después de confirmar (si la sesión era propia)
+                self._tiempo_cache.update(nuevos)
             
-            # Buscar coincidencias
-            search_query = """
-                SELECT t.id_tiempo, t.fecha, t.hora, t.minuto 
-                FROM dim_tiempo t
-                INNER JOIN temp_tiempos_search ts ON 
-                    t.fecha = ts.fecha AND 
-                    t.hora = ts.hora AND 
-                    t.minuto = ts.minuto
-            """
-            
-            result = session.execute(text(search_query))
-            tiempos_map = {}
-            for row in result.mappings():
-                key = (row['fecha'], row['hora'], row['minuto'])
-                tiempos_map[key] = row['id_tiempo']
-                
-            self.logger.debug(f"Encontrados {len(tiempos_map)} tiempos existentes")
+            # Una clave que RETURNING no devolvió igual queda fuera del mapeo y sus
+            # filas se omiten, en lugar de abortar la migración con un KeyError
+            cache = self._tiempo_cache
+            tiempos_map = {key: cache[key] for key in keys if key in cache}
+            if len(tiempos_map) < len(by_key):
+                faltantes = [key for key in by_key if key not in tiempos_map]
+                self.logger.warning("Tiempos sin id tras el upsert (%d): %s", len(faltantes), faltantes[:10])
+            self.logger.debug("Procesados %d tiempos: %d distintos (%d consultados)", len(tiempos_data), len(tiempos_map), len(pending))
             return tiempos_map
-        except Exception as e:
-            self.logger.error(f"Error en _get_existing_tiempos_batch: {e}")
-            session.rollback()
-            return {}
+        
+        except SQLAlchemyError as e:
+            self.logger.error("Error en insert_or_get_tiempos: %s", e)
+            raise
     
-    def _insert_new_tiempos_batch(self, session, new_tiempos: List[Dict[str, Any]]) -> Dict[tuple, int]:
-        """Inserta nuevos tiempos en lotes y retorna sus IDs"""
-        if not new_tiempos:
-            return {}
+    def clear_cache(self):
+        """Descarta los ids en caché (p. ej. tras un rollback que deshizo inserciones)"""
+        self._tiempo_cache.clear()
+    
+    def _upsert_tiempos(self, session, tiempos_data: List[Dict[str, Any]]) -> Dict[tuple, int]:
+        """Inserta o recupera todos los tiempos en una sola sentencia y retorna sus IDs"""
+        # Los valores por defecto se calculan solo si faltan (dict.get los evaluaría
+        # siempre) y strftime corre una vez por fecha distinta, no por tiempo
+        claves_por_fecha = {}
+        cuartos_hora = []
+        claves_anio_mes = []
+        for t in tiempos_data:
+            cuarto_hora = t.get('cuarto_hora')
+            cuartos_hora.append((t['hora'] * 4) + (t['minuto'] // 15) if cuarto_hora is None else cuarto_hora)
+            
+            clave = t.get('clave_anio_mes')
+            if clave is None:
+                clave = claves_por_fecha.get(t['fecha'])
+                if clave is None:
+                    clave = claves_por_fecha[t['fecha']] = t['fecha'].strftime('%Y-%m')
+            claves_anio_mes.append(clave)
         
-        nuevos_ids = {}
+        params = {
+            'fechas': [t['fecha'] for t in tiempos_data],
+            'horas': [t['hora'] for t in tiempos_data],
+            'minutos': [t['minuto'] for t in tiempos_data],
+            'cuartos_hora': cuartos_hora,
+            'claves_anio_mes': claves_anio_mes
+        }
         
-        try:
-            # Insertar uno por uno para poder obtener los RETURNING values
-            insert_query = text("""
-                INSERT INTO dim_tiempo (fecha, hora, minuto, cuarto_hora, clave_anio_mes)
-                VALUES (:fecha, :hora, :minuto, :cuarto_hora, :clave_anio_mes)
-                ON CONFLICT (fecha, hora, minuto) DO NOTHING
-                RETURNING id_tiempo, fecha, hora, minuto
-            """)
-            
-            # Insertar cada tiempo individualmente para capturar los RETURNING
-            for tiempo in new_tiempos:
-                params = {
-                    'fecha': tiempo['fecha'],
-                    'hora': tiempo['hora'],
-                    'minuto': tiempo['minuto'],
-                    'cuarto_hora': tiempo.get('cuarto_hora', (tiempo['hora'] * 4) + (tiempo['minuto'] // 15)),
-                    'clave_anio_mes': tiempo.get('clave_anio_mes', tiempo['fecha'].strftime('%Y-%m'))
-                }
-                
-                result = session.execute(insert_query, params)
-                row = result.fetchone()
-                
-                if row:
-                    # Se insertó correctamente, capturar el ID
-                    key = (row[1], row[2], row[3])  # fecha, hora, minuto
-                    nuevos_ids[key] = row[0]  # id_tiempo
-                    self.logger.debug(f"Tiempo insertado: {key} (ID: {row[0]})")
-            
-            # Si hay registros que no se insertaron (por conflicto), obtener sus IDs
-            inserted_keys = set(nuevos_ids.keys())
-            all_keys = {(t['fecha'], t['hora'], t['minuto']) for t in new_tiempos}
-            missing_keys = all_keys - inserted_keys
-            
-            if missing_keys:
-                self.logger.info(f"Recuperando {len(missing_keys)} IDs de tiempos que ya existían")
-                # Obtener los IDs de los registros que ya existían
-                missing_tiempos_map = self._get_existing_tiempos_batch(session, list(missing_keys))
-                nuevos_ids.update(missing_tiempos_map)
-            
-            self.logger.info(f"Insertados/recuperados {len(nuevos_ids)} nuevos tiempos")
-            return nuevos_ids
-            
-        except Exception as e:
-            self.logger.error(f"Error en _insert_new_tiempos_batch: {e}")
-            raise
+        result = session.execute(self._upsert_stmt, params)
+        # Si dim_tiempo.fecha es timestamp, RETURNING entrega datetime: se lleva a date
+        # para que coincida con las claves que arman los procesadores
+        return {
+            (fecha.date() if isinstance(fecha, datetime) else fecha, hora, minuto): id_tiempo
+            for id_tiempo, fecha, hora, minuto in result
+        }
     
-class DataRepository:
+class DataRepository(BaseRepository):
     """Repositorio principal para inserción de datos"""
     
     def __init__(self, db_connection):
-        self.db = db_connection
+        super().__init__(db_connection)
         self.barra_repo = BarraRepository(db_connection)
         self.tiempo_repo = TiempoRepository(db_connection)
-        self.logger = logging.getLogger(__name__)
         
-    def _parse_fecha_problematica(self, fecha_str):
-        """Parse fechas en formatos problemáticos como 2410"""
+        # Sentencias de inserción construidas una sola vez; SQLAlchemy reutiliza
+        # su forma compilada en cada lote en vez de analizar el SQL de nuevo.
+        # Cada parámetro es una columna completa (arreglo) que unnest convierte en filas
+        self._precio_stmt = text("""
+            INSERT INTO costo_marginal (tiempo_id, barra_id, cmg_mills_kwh, cmg_usd_kwh, usd)
+            SELECT * FROM unnest(
+                CAST(:tiempo_id AS integer[]),
+                CAST(:barra_id AS integer[]),
+                CAST(:cmg_mills_kwh AS float8[]),
+                CAST(:cmg_usd_kwh AS float8[]),
+                CAST(:usd AS float8[])
+            )
+        """)
+        self._retiro_stmt = text("""
+            INSERT INTO retiro_energia (tiempo_id, barra_id, suministrador, retiro, clave, tipo, clave_anio_mes, medida_kwh)
+            SELECT * FROM unnest(
+                CAST(:tiempo_id AS integer[]),
+                CAST(:barra_id AS integer[]),
+                CAST(:suministrador AS text[]),
+                CAST(:retiro AS text[]),
+                CAST(:clave AS text[]),
+                CAST(:tipo AS text[]),
+                CAST(:clave_anio_mes AS text[]),
+                CAST(:medida_kwh AS float8[])
+            )
+        """)
+        self._contrato_stmt = text("""
+            INSERT INTO contrato_fisico (tiempo_id, barra_id, clave, nom_empresa, transaccion, kwh, valorizado_clp, id_contrato, cmg_peso_kwh)
+            SELECT * FROM unnest(
+                CAST(:tiempo_id AS integer[]),
+                CAST(:barra_id AS integer[]),
+                CAST(:clave AS text[]),
+                CAST(:nom_empresa AS text[]),
+                CAST(:transaccion AS text[]),
+                CAST(:kwh AS float8[]),
+                CAST(:valorizado_clp AS float8[]),
+                CAST(:id_contrato AS integer[]),
+                CAST(:cmg_peso_kwh AS float8[])
+            )
+        """)
+    
+    def resolve_dims(self, barras_names: List[str], tiempos_data: List[Dict[str, Any]], session=None):
+        """Resuelve barras y tiempos y retorna (barras_map, tiempos_map)"""
+        # Una Session no se comparte entre hilos: con sesión compartida se resuelve en serie
+        if session is not None:
+            return (
+                self.barra_repo.insert_or_get_barras(barras_names, session=session),
+                self.tiempo_repo.insert_or_get_tiempos(tiempos_data, session=session),
+            )
+        
+        # Sin sesión cada consulta toma su propia conexión del pool y sus esperas se solapan
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            barras_future = executor.submit(self.barra_repo.insert_or_get_barras, barras_names)
+            tiempos_future = executor.submit(self.tiempo_repo.insert_or_get_tiempos, tiempos_data)
+            return barras_future.result(), tiempos_future.result()
+    
+    @contextmanager
+    def migration_transaction(self):
+        """Sesión compartida por toda una migración: se confirma una sola vez al salir"""
         try:
-            # Si es un número como 2410, asumimos YYMM y agregar día 01
-            if isinstance(fecha_str, (int, float)) and 100 <= fecha_str <= 9999:
-                fecha_str = str(int(fecha_str))
-                if len(fecha_str) == 4:
-                    # Formato YYMM -> asumimos YYMMDD con DD=01
-                    return datetime.strptime(fecha_str + '01', '%y%m%d').date()
-                elif len(fecha_str) == 3:
-                    # Formato YMD donde Y es 2? - manejar caso especial
-                    return datetime.strptime('0' + fecha_str, '%y%m%d').date()
-            
-            # Si es string, intentar diferentes formatos
-            if isinstance(fecha_str, str):
-                fecha_str = str(fecha_str).strip()
-                
-                # Formato YYMM
-                if len(fecha_str) == 4 and fecha_str.isdigit():
-                    return datetime.strptime(fecha_str + '01', '%y%m%d').date()
-                
-                # Formato YYMMDD
-                elif len(fecha_str) == 6 and fecha_str.isdigit():
-                    return datetime.strptime(fecha_str, '%y%m%d').date()
-                
-                # Formato estándar
-                else:
-                    return pd.to_datetime(fecha_str).date()
-                    
-            # Si ya es datetime o date
-            elif isinstance(fecha_str, (datetime, pd.Timestamp)):
-                return fecha_str.date()
-            elif isinstance(fecha_str, pd._libs.tslibs.nattype.NaTType):
-                return None
-                
-        except Exception as e:
-            self.logger.warning(f"No se pudo parsear la fecha: {fecha_str}. Error: {e}")
-            return None
+            with self._session_scope() as session:
+                # Solo para esta transacción: el COMMIT no espera el fsync del WAL y las
+                # restricciones DEFERRABLE se verifican al confirmar, no en cada fila
+                session.execute(text("SET LOCAL synchronous_commit = off"))
+                session.execute(text("SET CONSTRAINTS ALL DEFERRED"))
+                yield session
+        except Exception:
+            # El rollback deshizo las dimensiones insertadas: sus ids en caché ya no existen
+            self.barra_repo.clear_cache()
+            self.tiempo_repo.clear_cache()
+            raise
+    
+    def ensure_unique_indexes(self):
+        """Crea los índices únicos que requieren los upserts ON CONFLICT de las dimensiones, solo si faltan"""
+        # Cualquier índice único válido y sin predicado sobre esas mismas columnas
+        # (PK y restricciones UNIQUE incluidas) ya sirve a ON CONFLICT: se compara
+        # el conjunto de columnas y no el nombre, así no se duplica una restricción existente
+        existe_stmt = text("""
+            SELECT EXISTS (
+                SELECT 1 FROM pg_index x
+                WHERE x.indrelid = CAST(:tabla AS regclass)
+                  AND x.indisunique AND x.indisvalid
+                  AND x.indpred IS NULL AND x.indexprs IS NULL
+                  AND x.indnkeyatts = cardinality(CAST(:columnas AS text[]))
+                  AND (
+                      SELECT array_agg(a.attname::text)
+                      FROM unnest(CAST(x.indkey AS int2[])) WITH ORDINALITY AS k(attnum, pos)
+                      JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = k.attnum
+                      WHERE k.pos <= x.indnkeyatts
+                  ) @> CAST(:columnas AS text[])
+            )
+        """)
+        # Un CREATE ... CONCURRENTLY interrumpido deja el índice con ese nombre pero
+        # INVALID: no sirve a ON CONFLICT y haría que IF NOT EXISTS no lo reconstruya
+        invalido_stmt = text("SELECT NOT x.indisvalid FROM pg_index x WHERE x.indexrelid = to_regclass(:nombre)")
+        try:
+            engine = self.db.get_engine()
+            # CONCURRENTLY no bloquea escrituras en las tablas, pero no puede correr
+            # dentro de una transacción: se usa una conexión en AUTOCOMMIT
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                for tabla, (nombre, columnas) in DIM_UNIQUE_INDEXES.items():
+                    if conn.execute(existe_stmt, {'tabla': tabla, 'columnas': columnas}).scalar():
+                        continue
+                    if conn.execute(invalido_stmt, {'nombre': nombre}).scalar():
+                        self.logger.warning("Índice %s inválido (construcción interrumpida): se elimina y se vuelve a crear", nombre)
+                        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {nombre}"))
+                    self.logger.info("Creando índice único %s en %s", nombre, tabla)
+                    conn.execute(text(f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {nombre} ON {tabla} ({', '.join(columnas)})"))
+        except SQLAlchemyError as e:
+            self.logger.error("Error en ensure_unique_indexes: %s", e)
+            raise
+    
+    def drop_secondary_indexes(self, session, tables: List[str]) -> List[str]:
+        """Elimina los índices de `tables` que no respaldan restricciones y retorna sus definiciones"""
+        # Los índices de PK/UNIQUE/EXCLUDE pertenecen a una restricción y se mantienen
+        result = session.execute(text("""
+            SELECT i.schemaname, i.indexname, i.indexdef
+            FROM pg_indexes i
+            WHERE i.schemaname = current_schema()
+              AND i.tablename = ANY(CAST(:tables AS text[]))
+              AND NOT EXISTS (
+                  SELECT 1 FROM pg_constraint c
+                  WHERE c.conindid = (quote_ident(i.schemaname) || '.' || quote_ident(i.indexname))::regclass
+              )
+        """), {'tables': tables})
+        indexes = result.fetchall()
         
-        return None
+        for schema, name, _ in indexes:
+            session.execute(text(f'DROP INDEX "{schema}"."{name}"'))
+        
+        self.logger.info("Índices secundarios eliminados para la carga: %s", [name for _, name, _ in indexes])
+        return [indexdef for _, _, indexdef in indexes]
+    
+    def restore_indexes(self, session, indexdefs: List[str]):
+        """Vuelve a crear los índices eliminados por drop_secondary_indexes"""
+        if not indexdefs:
+            return
+        # Más memoria para ordenar durante la construcción, solo en esta transacción
+        session.execute(text("SET LOCAL maintenance_work_mem = '1GB'"))
+        for indexdef in indexdefs:
+            session.execute(text(indexdef))
+        self.logger.info("Índices secundarios recreados: %d", len(indexdefs))
+        
+    def _parse_fecha_problematica(self, fecha_str):
+        """Parse fechas en formatos problemáticos como 2410, con caché acotada del módulo"""
+        return _parse_fecha_problematica(fecha_str)
+    
+    def process_retiros_energia(self, data_retiros: Iterable[Dict[str, Any]], chunksize: int = 10000) -> Iterator[List[Dict[str, Any]]]:
+        """Procesa datos de retiros de energía y entrega bloques de hasta `chunksize` registros"""
+        # Acepta cualquier iterable: nunca se materializa más de un bloque a la vez
+        registros = iter(data_retiros)
+        while True:
+            bloque = list(islice(registros, chunksize))
+            if not bloque:
+                return
+            procesados = self._process_retiros_chunk(bloque)
+            if procesados:
+                yield procesados
     
-    def process_retiros_energia(self, data_retiros):
-        """Procesa datos de retiros de energía"""
-        processed_data = []
+    def _process_retiros_chunk(self, data_retiros: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Procesa un bloque de retiros de energía con operaciones vectorizadas de pandas"""
+        columnas = ['fecha', 'hora', 'minuto', 'barra', 'suministrador', 'retiro', 'clave', 'tipo', 'medida_kwh']
+        df = pd.DataFrame(data_retiros).reindex(columns=columnas)
+        
+        # Parsear fecha problemática: cada valor distinto se parsea una sola vez
+        fechas = {valor: self._parse_fecha_problematica(valor) for valor in df['fecha'].unique()}
+        df['fecha'] = df['fecha'].map(fechas)
+        invalidas = df['fecha'].isna()
+        
+        # Hora y minuto ausentes valen 0; un valor no numérico descarta la fila
+        for columna in ('hora', 'minuto'):
+            numeros = pd.to_numeric(df[columna], errors='coerce')
+            invalidas |= numeros.isna() & df[columna].notna()
+            df[columna] = numeros.fillna(0)
         
-        for item in data_retiros:
-            try:
-                # Parsear fecha problemática
-                fecha = self._parse_fecha_problematica(item.get('fecha'))
-                if fecha is None:
-                    self.logger.warning(f"Fecha inválida omitida: {item.get('fecha')}")
-                    continue
-                
-                # Validar otros campos requeridos
-                hora = item.get('hora', 0)
-                minuto = item.get('minuto', 0)
-                barra_nombre = item.get('barra')
-                
-                if not barra_nombre:
-                    self.logger.warning("Registro omitido: falta nombre de barra")
-                    continue
-                
-                processed_data.append({
-                    'fecha': fecha,
-                    'hora': int(hora) if hora is not None else 0,
-                    'minuto': int(minuto) if minuto is not None else 0,
-                    'barra': barra_nombre,
-                    'suministrador': item.get('suministrador'),
-                    'retiro': item.get('retiro'), 
-                    'clave': item.get('clave'),
-                    'tipo': item.get('tipo'),
-                    'medida_kwh': float(item.get('medida_kwh', 0)) if item.get('medida_kwh') not in [None, ''] else 0.0
-                })
-                
-            except Exception as e:
-                self.logger.error(f"Error procesando registro de retiros: {item}. Error: {e}")
-                continue
+        # Medida vacía vale 0.0; un valor no numérico descarta la fila
+        medida = pd.to_numeric(df['medida_kwh'].replace('', None), errors='coerce')
+        invalidas |= medida.isna() & df['medida_kwh'].notna() & (df['medida_kwh'] != '')
+        df['medida_kwh'] = medida.fillna(0.0).astype('float64')
         
-        return processed_data
+        sin_barra = ~df['barra'].fillna('').astype(bool)
+        
+        omitidos = int((invalidas | sin_barra).sum())
+        if omitidos:
+            self.logger.warning("Registros de retiros omitidos por fecha, barra o valores inválidos: %d", omitidos)
+        
+        df = df[~(invalidas | sin_barra)].astype({'hora': 'int64', 'minuto': 'int64'})
+        
+        # NaN de pandas -> None, como devolvía item.get() para campos ausentes
+        texto = ['suministrador', 'retiro', 'clave', 'tipo']
+        df[texto] = df[texto].astype(object).where(df[texto].notna(), None)
+        
+        return df.to_dict(orient='records')
     
-    def insert_precios_marginales(self, precios_data: List[Dict[str, Any]]) -> int:
-        """Inserta datos de precios marginales"""
-        session = self.db.get_session()
+    def _copy_rows(self, session, table: str, columns: List[str], data: Dict[str, List[Any]]):
+        """Carga columnas con COPY ... FROM STDIN sobre la conexión psycopg2 de la sesión"""
+        buffer = io.StringIO()
+        # Texto siempre entre comillas y números sin ellas: ningún texto se confunde con NULL
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+        rows = zip(*(data[col] for col in columns))
+        # El reemplazo fila a fila solo se paga si alguna columna trae nulos
+        if any(None in data[col] for col in columns):
+            rows = ([_COPY_NULL if value is None else value for value in row] for row in rows)
+        writer.writerows(rows)
+        buffer.seek(0)
+        
+        copy_query = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT CSV)"
+        cursor = session.connection().connection.cursor()
         try:
-            insert_query = """
-                INSERT INTO costo_marginal (tiempo_id, barra_id, cmg_mills_kwh, cmg_usd_kwh, usd)
-                VALUES (:tiempo_id, :barra_id, :cmg_mills_kwh, :cmg_usd_kwh, :usd)
-            """
-            
-            for precio in precios_data:
-                session.execute(text(insert_query), precio)
+            cursor.copy_expert(copy_query, buffer)
+        finally:
+            cursor.close()
+    
+    def insert_precios_marginales(self, precios_data: Dict[str, List[Any]], session=None) -> int:
+        """Inserta datos de precios marginales recibidos como columnas (nombre -> lista de valores)"""
+        try:
+            count = len(precios_data['tiempo_id'])
+            with self._session_scope(session) as session:
+                if count >= COPY_MIN_ROWS:
+                    columns = ['tiempo_id', 'barra_id', 'cmg_mills_kwh', 'cmg_usd_kwh', 'usd']
+                    self._copy_rows(session, 'costo_marginal', columns, precios_data)
+                else:
+                    # Una sola sentencia con un arreglo por columna
+                    session.execute(self._precio_stmt, precios_data)
             
-            session.commit()
-            count = len(precios_data)
-            self.logger.info(f"Insertados {count} registros en precio_marginal")
+            self.logger.debug("Insertados %d registros en precio_marginal", count)
             return count
             
-        except SQLAlchemyError as e:
-            session.rollback()
-            self.logger.error(f"Error en insert_precios_marginales: {e}")
+        except (SQLAlchemyError, psycopg2.Error) as e:
+            self.logger.error("Error en insert_precios_marginales: %s", e)
             raise
-        finally:
-            session.close()
     
-    def insert_retiros_energia(self, retiros_data: List[Dict[str, Any]]) -> int:
-        """Inserta datos de retiros de energía"""
-        session = self.db.get_session()
+    def insert_retiros_energia(self, retiros_data: Dict[str, List[Any]], session=None) -> int:
+        """Inserta datos de retiros de energía recibidos como columnas (nombre -> lista de valores)"""
         try:
-            insert_query = """
-                INSERT INTO retiro_energia (tiempo_id, barra_id, suministrador, retiro, clave, tipo, clave_anio_mes, medida_kwh)
-                VALUES (:tiempo_id, :barra_id, :suministrador, :retiro, :clave, :tipo, :clave_anio_mes, :medida_kwh)
-            """
-            
-            for retiro in retiros_data:
-                session.execute(text(insert_query), retiro)
+            count = len(retiros_data['tiempo_id'])
+            with self._session_scope(session) as session:
+                if count >= COPY_MIN_ROWS:
+                    columns = ['tiempo_id', 'barra_id', 'suministrador', 'retiro', 'clave', 'tipo', 'clave_anio_mes', 'medida_kwh']
+                    self._copy_rows(session, 'retiro_energia', columns, retiros_data)
+                else:
+                    # Una sola sentencia con un arreglo por columna
+                    session.execute(self._retiro_stmt, retiros_data)
             
-            session.commit()
-            count = len(retiros_data)
-            self.logger.info(f"Insertados {count} registros en retiro_energia")
+            self.logger.debug("Insertados %d registros en retiro_energia", count)
             return count
             
-        except SQLAlchemyError as e:
-            session.rollback()
-            self.logger.error(f"Error en insert_retiros_energia: {e}")
+        except (SQLAlchemyError, psycopg2.Error) as e:
+            self.logger.error("Error en insert_retiros_energia: %s", e)
             raise
-        finally:
-            session.close()
     
-    def insert_contratos_fisicos(self, contratos_data: List[Dict[str, Any]]) -> int:
-        """Inserta datos de contratos físicos"""
-        session = self.db.get_session()
+    def insert_contratos_fisicos(self, contratos_data: Dict[str, List[Any]], session=None) -> int:
+        """Inserta datos de contratos físicos recibidos como columnas (nombre -> lista de valores)"""
         try:
-            insert_query = """
-                INSERT INTO contrato_fisico (tiempo_id, barra_id, clave, nom_empresa, transaccion, kwh, valorizado_clp, id_contrato, cmg_peso_kwh)
-                VALUES (:tiempo_id, :barra_id, :clave, :nom_empresa, :transaccion, :kwh, :valorizado_clp, :id_contrato, :cmg_peso_kwh)
-            """
-            
-            for contrato in contratos_data:
-                session.execute(text(insert_query), contrato)
+            count = len(contratos_data['tiempo_id'])
+            with self._session_scope(session) as session:
+                if count >= COPY_MIN_ROWS:
+                    columns = ['tiempo_id', 'barra_id', 'clave', 'nom_empresa', 'transaccion', 'kwh', 'valorizado_clp', 'id_contrato', 'cmg_peso_kwh']
+                    self._copy_rows(session, 'contrato_fisico', columns, contratos_data)
+                else:
+                    # Una sola sentencia con un arreglo por columna
+                    session.execute(self._contrato_stmt, contratos_data)
             
-            session.commit()
-            count = len(contratos_data)
-            self.logger.info(f"Insertados {count} registros en contrato_fisico")
+            self.logger.debug("Insertados %d registros en contrato_fisico", count)
             return count
             
-        except SQLAlchemyError as e:
-            session.rollback()
-            self.logger.error(f"Error en insert_contratos_fisicos: {e}")
+        except (SQLAlchemyError, psycopg2.Error) as e:
+            self.logger.error("Error en insert_contratos_fisicos: %s", e)
             raise
-        finally:
-            session.close()
@@ -1,15 +1,139 @@
+import codecs
 import csv
 import logging
-from datetime import datetime
-from typing import List, Dict, Any
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date
+from functools import lru_cache
+from itertools import islice
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 import os
+import re
+import sys
 from tqdm import tqdm
 
+# Búfer de lectura de los CSV (el predeterminado de 8 KB implica muchas lecturas pequeñas)
+_READ_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Encoding de respaldo si el archivo no es válido en el pedido: acepta cualquier byte, nunca falla
+_FALLBACK_ENCODING = 'latin-1'
+
+# Formatos de fecha estándar agrupados por separador, en el orden de prioridad original
+_DATE_FORMATS_BY_SEPARATOR = {
+    '': ['%Y%m%d'],                  # 20241004
+    '-': ['%Y-%m-%d',                # 2024-10-04
+          '%d-%m-%Y'],               # 04-10-2024
+    '/': ['%d/%m/%Y',                # 04/10/2024
+          '%m/%d/%Y',                # 10/04/2024
+          '%Y/%m/%d',                # 2024/10/04
+          '%d/%m/%y',                # 04/10/24
+          '%m/%d/%y'],               # 10/04/24
+    '.': ['%d.%m.%Y',                # 04.10.2024
+          '%d.%m.%y'],               # 04.10.24
+}
+
+# Fechas con separador en una sola pasada: tres grupos de dígitos, mismo separador
+_SEPARATED_DATE_RE = re.compile(r'(\d{1,4})([-/.])(\d{1,2})\2(\d{1,4})')
+
+# Los mismos formatos como (grupo año, grupo mes, grupo día, dígitos del año), en igual prioridad
+_DATE_ORDERS_BY_SEPARATOR = {
+    '-': [(0, 1, 2, 4), (2, 1, 0, 4)],
+    '/': [(2, 1, 0, 4), (2, 0, 1, 4), (0, 1, 2, 4), (2, 1, 0, 2), (2, 0, 1, 2)],
+    '.': [(2, 1, 0, 4), (2, 1, 0, 2)],
+}
+
+def _yy_to_year(yy: int) -> int:
+    """Año de dos dígitos con el mismo pivote que %y: 00-68 -> 20xx, 69-99 -> 19xx"""
+    return yy + (2000 if yy < 69 else 1900)
+
+def _parse_separated_date(date_str: str) -> Optional[date]:
+    """Parsea fechas con separador sin strptime; None si ningún orden es válido"""
+    match = _SEPARATED_DATE_RE.fullmatch(date_str)
+    if not match:
+        return None
+    
+    first, separator, second, third = match.groups()
+    parts = (first, second, third)
+    for year_group, month_group, day_group, year_digits in _DATE_ORDERS_BY_SEPARATOR[separator]:
+        if len(parts[year_group]) != year_digits or len(parts[month_group]) > 2 or len(parts[day_group]) > 2:
+            continue
+        year = int(parts[year_group])
+        if year_digits == 2:
+            year = _yy_to_year(year)
+        try:
+            return date(year, int(parts[month_group]), int(parts[day_group]))
+        except ValueError:
+            continue
+    return None
+
+_logger = logging.getLogger(__name__)
+
+# Columnas que lee cada validador, declaradas una sola vez
+_PRECIOS_COLUMNS = ('FECHA', 'HORA', 'MINUTO', 'BARRA', 'CMg[mills/kWh]', 'CMg[$/KWh]', 'USD')
+_CONTRATOS_COLUMNS = ('Cuarto de Hora', 'Barra', 'clave', 'Empresa', 'TransacciÃ³n', 'Kwhh', 'Valorizado_CLP', 'Id_Contrato', 'CMG_PESO_KWH')
+
+@lru_cache(maxsize=1 << 17)
+def _parse_date_cached(date_str: str) -> Optional[date]:
+    """Parsea fechas en diferentes formatos incluyendo YYMM; memoizada para todos los archivos del proceso"""
+    if not date_str or str(date_str).lower() in ['nan', 'nat', 'none', '']:
+        return None
+    
+    # Convertir a string y limpiar
+    date_str = str(date_str).strip()
+    
+    # Si es un número, manejar formatos cortos
+    if date_str.isdigit():
+        length = len(date_str)
+        
+        # Cortes enteros en lugar de strptime
+        if length == 4:  # YYMM
+            try:
+                # 2410 -> 2024-10-01
+                return date(_yy_to_year(int(date_str[:2])), int(date_str[2:]), 1)
+            except ValueError:
+                pass
+        
+        elif length == 6:  # YYMMDD o YYYYMM
+            try:
+                # 241001 -> 2024-10-01 (YYMMDD)
+                return date(_yy_to_year(int(date_str[:2])), int(date_str[2:4]), int(date_str[4:]))
+            except ValueError:
+                try:
+                    # 202410 -> 2024-10-01 (YYYYMM)
+                    return date(int(date_str[:4]), int(date_str[4:]), 1)
+                except ValueError:
+                    pass
+        
+        elif length == 8:  # YYYYMMDD
+            try:
+                return date(int(date_str[:4]), int(date_str[4:6]), int(date_str[6:]))
+            except ValueError:
+                pass
+    
+    fecha = _parse_separated_date(date_str)
+    if fecha:
+        return fecha
+    
+    # Respaldo: los formatos que usan el separador presente en la fecha
+    separator = next((sep for sep in '-/.' if sep in date_str), '')
+    
+    for fmt in _DATE_FORMATS_BY_SEPARATOR[separator]:
+        try:
+            return datetime.strptime(date_str, fmt).date()
+        except ValueError:
+            continue
+    
+    _logger.warning("No se pudo parsear la fecha: %s", date_str)
+    return None
+
 class SimpleDataLoader:
     """Cargador de datos usando solo Python estándar (sin pandas)"""
     
-    def __init__(self):
+    def __init__(self, validation_workers: Optional[int] = None):
         self.logger = logging.getLogger(__name__)
+        # Procesos para validar bloques en paralelo; None valida en el proceso actual
+        self.validation_workers = validation_workers
         
     def debug_file_structure(self, file_path: str):
         """Función para debuggear la estructura del archivo"""
@@ -19,88 +143,213 @@ class SimpleDataLoader:
             # Leer primeras 5 líneas
             for i in range(5):
                 line = file.readline()
-                self.logger.info(f"Línea {i}: {line.strip()}")
+                self.logger.info("Línea %d: %s", i, line.strip())
         
-        # Contar líneas totales
-        with open(file_path, 'r', encoding='latin-1') as file:
-            line_count = sum(1 for _ in file)
-            self.logger.info(f"Total de líneas en archivo: {line_count}")
+        # Contar líneas totales sobre los bytes por bloques, sin decodificar línea por línea
+        line_count = 0
+        last_block = b''
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(_READ_BUFFER_SIZE), b''):
+                line_count += block.count(b'\n')
+                last_block = block
+        # La última línea sin salto final también cuenta
+        if last_block and not last_block.endswith(b'\n'):
+            line_count += 1
+        self.logger.info("Total de líneas en archivo: %d", line_count)
     
     
-    def load_csv(self, file_path: str, encoding='utf-8') -> List[Dict[str, Any]]:
-        """Carga un archivo CSV y retorna lista de diccionarios"""
+    def iter_csv_rows(self, file_path: str, chunksize: int = 5000, encoding='utf-8') -> Iterator[Tuple[List[str], List[List[str]]]]:
+        """Lee un archivo CSV por bloques y entrega (encabezados, hasta `chunksize` filas como listas)"""
         try:
-            self.logger.info(f"Cargando archivo: {file_path}")
+            self.logger.info("Cargando archivo: %s", file_path)
             
             # Verificar si el archivo existe y su tamaño
             file_size = os.path.getsize(file_path) / (1024 * 1024)  # Tamaño en MB
-            self.logger.info(f"Tamaño del archivo: {file_size:.2f} MB")
+            self.logger.info("Tamaño del archivo: %.2f MB", file_size)
+        
+        except Exception as e:
+            self.logger.error("Error cargando archivo %s: %s", file_path, e)
+            return
+        
+        # El encoding se decide sobre la misma lectura que se parsea: se decodifica en
+        # modo estricto con `encoding` y, ante el primer byte inválido, se reinicia una
+        # sola vez con latin-1. Un archivo válido (el caso común) se lee una sola vez
+        first_header = None
+        delivered = 0
+        for enc in dict.fromkeys([encoding, _FALLBACK_ENCODING]):
+            try:
+                for header, chunk in self._read_csv_rows(file_path, chunksize, enc, skip=delivered):
+                    # Tras un reinicio se conservan los encabezados ya entregados,
+                    # con los que se resolvieron las columnas
+                    first_header = first_header or header
+                    delivered += len(chunk)
+                    yield first_header, chunk
+                return
+            except UnicodeDecodeError as e:
+                if codecs.lookup(enc).name == codecs.lookup(_FALLBACK_ENCODING).name:
+                    raise
+                # Las filas ya entregadas eran válidas en `enc` y no se repiten: la
+                # nueva lectura las salta (los delimitadores son ASCII en ambos encodings)
+                self.logger.warning("El archivo %s no es %s válido (%s); se relee con %s desde la fila %d",
+                                    file_path, enc, e.reason, _FALLBACK_ENCODING, delivered)
+    
+    def _read_csv_rows(self, file_path: str, chunksize: int, encoding: str, skip: int = 0) -> Iterator[Tuple[List[str], List[List[str]]]]:
+        """Recorre el CSV con `encoding` estricto, omite las primeras `skip` filas y entrega bloques de hasta `chunksize`"""
+        # newline='' es lo que espera el módulo csv; el búfer grande reduce las lecturas al disco
+        with open(file_path, 'r', encoding=encoding, newline='', buffering=_READ_BUFFER_SIZE) as file:
+            # Detectar delimitador en la línea de encabezados: no trae decimales con
+            # coma que confundan el conteo (csv.Sniffer prefiere ',' en ese caso)
+            header = file.readline()
+            file.seek(0)
+            delimiter = max(',;\t|', key=header.count)
             
-            # Intentar diferentes encodings
-            encodings = [encoding, 'latin-1', 'utf-8-sig', 'iso-8859-1']
+            # Leer CSV: csv.reader entrega listas, sin un diccionario nuevo por fila
+            reader = csv.reader(file, delimiter=delimiter)
+            header = next(reader, None)
             
-            for enc in encodings:
-                try:
-                    with open(file_path, 'r', encoding=enc) as file:
-                        # Detectar delimitador
-                        sample = file.read(4096)
-                        file.seek(0)
-                        delimiter = ',' if sample.count(',') > sample.count(';') else ';'
-                        
-                        # Leer CSV
-                        reader = csv.DictReader(file, delimiter=delimiter)
-                        
-                        # Mostrar columnas disponibles para debugging
-                        if reader.fieldnames:
-                            self.logger.info(f"Columnas encontradas: {reader.fieldnames}")
-                        
-                        data = []
-                        for row in reader:
-                            data.append(row)
-                            if len(data) % 100000 == 0:  # Log cada 100k registros
-                                self.logger.info(f"Registros cargados: {len(data)}")
-                        
-                        self.logger.info(f"Archivo cargado con encoding {enc}: {len(data)} registros")
-                        return data
-                        
-                except UnicodeDecodeError:
-                    continue
+            # Mostrar columnas disponibles para debugging
+            if header and not skip:
+                self.logger.info("Columnas encontradas: %s", header)
+            
+            rows = (row for row in reader if row)  # Líneas vacías, igual que csv.DictReader
+            total = skip
+            chunk = []
+            for row in islice(rows, skip, None):
+                chunk.append(row)
+                if len(chunk) >= chunksize:
+                    total += len(chunk)
+                    if total // 100000 > (total - len(chunk)) // 100000:  # Log cada 100k registros
+                        self.logger.info("Registros cargados: %d", total)
+                    yield header, chunk
+                    chunk = []
             
-            raise ValueError(f"No se pudo decodificar el archivo {file_path} con los encodings probados")
+            if chunk:
+                total += len(chunk)
+                yield header, chunk
             
+            self.logger.info("Archivo cargado con encoding %s: %d registros", encoding, total)
+    
+    def iter_csv(self, file_path: str, chunksize: int = 5000, encoding='utf-8') -> Iterator[List[Dict[str, Any]]]:
+        """Lee un archivo CSV por bloques y entrega listas de hasta `chunksize` diccionarios"""
+        for header, chunk in self.iter_csv_rows(file_path, chunksize, encoding):
+            yield [dict(zip(header, row)) for row in chunk]
+    
+    def load_csv(self, file_path: str, encoding='utf-8') -> List[Dict[str, Any]]:
+        """Carga un archivo CSV y retorna lista de diccionarios"""
+        try:
+            data = []
+            for chunk in self.iter_csv(file_path, encoding=encoding):
+                data.extend(chunk)
+            return data
+        
         except Exception as e:
-            self.logger.error(f"Error cargando archivo {file_path}: {e}")
+            self.logger.error("Error cargando archivo %s: %s", file_path, e)
             return []
     
     def load_precios_marginales(self, file_path: str) -> List[Dict[str, Any]]:
         """Carga datos de precios marginales"""
-        data = self.load_csv(file_path)
-        return self._validate_precios_data(data)
+        return [row for chunk in self.iter_precios_marginales(file_path) for row in chunk]
+    
+    def iter_precios_marginales(self, file_path: str, chunksize: int = 5000) -> Iterator[List[Dict[str, Any]]]:
+        """Carga datos de precios marginales por bloques validados, sin leer el archivo completo"""
+        chunks = ((chunk, header) for header, chunk in self.iter_csv_rows(file_path, chunksize))
+        yield from self._iter_validated(chunks, self._validate_precios_data, "precios marginales")
     
     def load_retiros_energia(self, file_path: str) -> List[Dict[str, Any]]:
         """Carga datos de retiros de energía"""
         self.logger.info("Cargando datos de retiros de energía...")
-        data = self.load_csv(file_path)
-        return self._validate_retiros_data(data)
+        return [row for chunk in self.iter_retiros_energia(file_path) for row in chunk]
+    
+    def iter_retiros_energia(self, file_path: str, chunksize: int = 5000) -> Iterator[List[Dict[str, Any]]]:
+        """Carga datos de retiros de energía por bloques validados, sin leer el archivo completo"""
+        self.logger.info("Cargando datos de retiros de energía por bloques...")
+        
+        def chunks():
+            columns = None
+            offset = 0
+            for header, chunk in self.iter_csv_rows(file_path, chunksize):
+                # Las columnas se resuelven una vez con los encabezados del archivo
+                if columns is None:
+                    self.logger.info("Primera fila de ejemplo: %s", header)
+                    columns = self._resolve_retiros_columns(header)
+                    if columns is None:
+                        return
+                
+                yield chunk, header, columns, offset
+                offset += len(chunk)
+        
+        yield from self._iter_validated(chunks(), self._validate_retiros_data, "retiros")
     
     def load_contratos_fisicos(self, file_path: str) -> List[Dict[str, Any]]:
         """Carga datos de contratos físicos"""
-        data = self.load_csv(file_path)
-        return self._validate_contratos_data(data)
+        return [row for chunk in self.iter_contratos_fisicos(file_path) for row in chunk]
+    
+    def iter_contratos_fisicos(self, file_path: str, chunksize: int = 5000) -> Iterator[List[Dict[str, Any]]]:
+        """Carga datos de contratos físicos por bloques validados, sin leer el archivo completo"""
+        chunks = ((chunk, header) for header, chunk in self.iter_csv_rows(file_path, chunksize))
+        yield from self._iter_validated(chunks, self._validate_contratos_data, "contratos")
     
-    def _validate_precios_data(self, data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def _iter_validated(self, chunks, validate, name: str) -> Iterator[List[Dict[str, Any]]]:
+        """Valida los bloques de un archivo conservando el orden, con una barra de progreso y un resumen por archivo"""
+        self.logger.info("Iniciando validación de %s...", name)
+        total_rows = 0
+        total_valid = 0
+        
+        # La barra avanza por bloque, no por fila, y es una sola para todo el archivo
+        with tqdm(desc=f"Validando {name}", unit=" filas", mininterval=0.5, smoothing=0) as progress:
+            for rows, cleaned_data in self._validate_chunks(chunks, validate):
+                total_rows += rows
+                total_valid += len(cleaned_data)
+                progress.update(rows)
+                yield cleaned_data
+        
+        self.logger.info("Datos de %s validados: %d registros de %d originales", name, total_valid, total_rows)
+    
+    def _validate_chunks(self, chunks, validate) -> Iterator[Tuple[int, List[Dict[str, Any]]]]:
+        """Aplica `validate` a cada tupla de argumentos, en serie o en procesos aparte, y entrega (filas leídas, filas válidas)"""
+        if not self.validation_workers:
+            for args in chunks:
+                yield len(args[0]), validate(*args)
+            return
+        
+        # La lectura sigue en este proceso (un solo recorrido del archivo, sin
+        # cortar campos con saltos de línea); solo la validación se reparte
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.validation_workers, mp_context=context) as executor:
+            pending = deque()
+            try:
+                for args in chunks:
+                    pending.append((len(args[0]), executor.submit(validate, *args)))
+                    # Ventana acotada: la memoria no crece si la base va más lenta que la validación
+                    if len(pending) >= 2 * self.validation_workers:
+                        rows, future = pending.popleft()
+                        yield rows, future.result()
+                
+                while pending:
+                    rows, future = pending.popleft()
+                    yield rows, future.result()
+            finally:
+                # Si se deja de leer a mitad de archivo, los bloques en cola no se validan:
+                # el cierre del pool solo espera a los que ya están en ejecución
+                for _, future in pending:
+                    future.cancel()
+    
+    def _validate_precios_data(self, data: List[List[str]], header: List[str]) -> List[Dict[str, Any]]:
         """Valida y limpia datos de precios marginales"""
         cleaned_data = []
         
+        # Posición de cada columna, resuelta una vez por bloque
+        index = {name: i for i, name in enumerate(header)}
+        missing = [key for key in _PRECIOS_COLUMNS if key not in index]
+        if missing:
+            self.logger.error("Columnas faltantes en precios marginales: %s", missing)
+            return cleaned_data
+        i_fecha, i_hora, i_minuto, i_barra, i_mills, i_usd_kwh, i_usd = (index[key] for key in _PRECIOS_COLUMNS)
+        
         for row in data:
             try:
-                # Validar campos requeridos
-                if not all(key in row for key in ['FECHA', 'HORA', 'MINUTO', 'BARRA']):
-                    continue
-                
                 # Convertir fecha - manejar múltiples formatos
-                fecha_str = str(row['FECHA']).strip()
-                fecha = self._parse_date(fecha_str)
+                fecha = self._parse_date(row[i_fecha].strip())
                 
                 if not fecha:
                     continue
@@ -108,95 +357,28 @@ class SimpleDataLoader:
                 # Convertir tipos
                 cleaned_row = {
                     'FECHA': fecha,
-                    'HORA': int(row['HORA']),
-                    'MINUTO': int(row['MINUTO']),
-                    'BARRA': row['BARRA'].strip(),
-                    'CMg[mills/kWh]': float(row['CMg[mills/kWh]']),
-                    'CMg[$/KWh]': float(row['CMg[$/KWh]']),
-                    'USD': float(row['USD'])
+                    'HORA': int(row[i_hora]),
+                    'MINUTO': int(row[i_minuto]),
+                    'BARRA': sys.intern(row[i_barra].strip()),
+                    'CMg[mills/kWh]': float(row[i_mills]),
+                    'CMg[$/KWh]': float(row[i_usd_kwh]),
+                    'USD': float(row[i_usd])
                 }
                 cleaned_data.append(cleaned_row)
                 
-            except (ValueError, KeyError) as e:
-                self.logger.warning(f"Fila inválida en precios marginales: {e}")
+            except (ValueError, IndexError) as e:
+                self.logger.warning("Fila inválida en precios marginales: %s", e)
                 continue
         
-        self.logger.info(f"Datos de precios marginales validados: {len(cleaned_data)} registros")
+        self.logger.debug("Bloque de precios marginales validado: %d registros", len(cleaned_data))
         return cleaned_data
     
     def _parse_date(self, date_str: str) -> datetime.date:
-        """Parsea fechas en diferentes formatos incluyendo YYMM"""
-        if not date_str or str(date_str).lower() in ['nan', 'nat', 'none', '']:
-            return None
-        
-        # Convertir a string y limpiar
-        date_str = str(date_str).strip()
-        
-        # Si es un número, manejar formatos cortos
-        if date_str.isdigit():
-            length = len(date_str)
-            
-            if length == 4:  # YYMM
-                try:
-                    # 2410 -> 2024-10-01
-                    return datetime.strptime(date_str + '01', '%y%m%d').date()
-                except ValueError:
-                    pass
-                    
-            elif length == 6:  # YYMMDD o YYYYMM
-                try:
-                    # 241001 -> 2024-10-01 (YYMMDD)
-                    return datetime.strptime(date_str, '%y%m%d').date()
-                except ValueError:
-                    try:
-                        # 202410 -> 2024-10-01 (YYYYMM)
-                        return datetime.strptime(date_str + '01', '%Y%m%d').date()
-                    except ValueError:
-                        pass
-                        
-            elif length == 8:  # YYYYMMDD
-                try:
-                    return datetime.strptime(date_str, '%Y%m%d').date()
-                except ValueError:
-                    pass
-        
-        # Formatos de fecha estándar con separadores
-        date_formats = [
-            '%Y%m%d',        # 20241004
-            '%Y-%m-%d',      # 2024-10-04
-            '%d/%m/%Y',      # 04/10/2024
-            '%m/%d/%Y',      # 10/04/2024
-            '%d-%m-%Y',      # 04-10-2024
-            '%Y/%m/%d',      # 2024/10/04
-            '%d/%m/%y',      # 04/10/24
-            '%m/%d/%y',      # 10/04/24
-            '%d.%m.%Y',      # 04.10.2024
-            '%d.%m.%y',      # 04.10.24
-        ]
-        
-        for fmt in date_formats:
-            try:
-                return datetime.strptime(date_str, fmt).date()
-            except ValueError:
-                continue
-        
-        self.logger.warning(f"No se pudo parsear la fecha: {date_str}")
-        return None
+        """Parsea fechas en diferentes formatos incluyendo YYMM, con caché compartida del módulo"""
+        return _parse_date_cached(date_str)
 
-    def _validate_retiros_data(self, data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Valida y limpia datos de retiros de energía con progreso"""
-        if not data:
-            self.logger.warning("No hay datos para validar")
-            return []
-            
-        self.logger.info(f"Iniciando validación de {len(data)} registros de retiros...")
-        cleaned_data = []
-        
-        # Verificar las claves requeridas en el primer registro
-        if data:
-            first_row = data[0]
-            self.logger.info(f"Primera fila de ejemplo: {list(first_row.keys())}")
-        
+    def _resolve_retiros_columns(self, header: List[str]):
+        """Retorna (columnas requeridas, columna de fecha) según los encabezados, o None"""
         # Definir posibles nombres de columnas (por problemas de encoding)
         possible_date_columns = ['Clave Año_Mes', 'Clave AÃ±o_Mes', 'Clave Anio_Mes', 'Fecha', 'fecha']
         
@@ -210,103 +392,125 @@ class SimpleDataLoader:
         # Encontrar qué conjunto de claves coincide
         valid_keys_set = None
         for key_set in required_keys_sets:
-            if all(key in data[0] for key in key_set):
+            if all(key in header for key in key_set):
                 valid_keys_set = key_set
-                self.logger.info(f"Usando conjunto de claves: {valid_keys_set}")
+                self.logger.info("Usando conjunto de claves: %s", valid_keys_set)
                 break
         
         if not valid_keys_set:
             self.logger.error("No se encontró un conjunto válido de columnas. Columnas disponibles:")
-            self.logger.error(list(data[0].keys()))
-            return []
+            self.logger.error(list(header))
+            return None
         
-        required_keys = valid_keys_set
-        date_column = [key for key in possible_date_columns if key in data[0]][0] if any(key in data[0] for key in possible_date_columns) else None
+        date_column = [key for key in possible_date_columns if key in header][0] if any(key in header for key in possible_date_columns) else None
         
         if not date_column:
             self.logger.error("No se encontró la columna de fecha")
+            return None
+        
+        self.logger.info("Usando columna de fecha: '%s'", date_column)
+        return valid_keys_set, date_column
+    
+    def _validate_retiros_data(self, data: List[List[str]], header: List[str], columns, offset: int = 0) -> List[Dict[str, Any]]:
+        """Valida y limpia datos de retiros de energía con progreso"""
+        if not data:
+            self.logger.warning("No hay datos para validar")
             return []
-            
-        self.logger.info(f"Usando columna de fecha: '{date_column}'")
         
-        # Usar tqdm para mostrar progreso
-        for i, row in enumerate(tqdm(data, desc="Validando retiros")):
+        self.logger.debug("Validando bloque de %d registros de retiros", len(data))
+        cleaned_data = []
+        
+        required_keys, date_column = columns
+        
+        # Posición de cada columna, resuelta una vez por bloque
+        index = {name: i for i, name in enumerate(header)}
+        required = [(key, index[key]) for key in required_keys]
+        width = max(i for _, i in required) + 1
+        i_fecha, i_cuarto, i_barra, i_suministrador, i_retiro, i_clave, i_tipo, i_medida = (
+            index[key] for key in (date_column, 'Cuarto de Hora', 'Barra', 'Suministrador', 'Retiro', 'clave', 'Tipo', 'Medida_kWh'))
+        
+        # El progreso se muestra por archivo en _iter_validated; `offset` mantiene
+        # la numeración global de filas
+        for i, row in enumerate(data, offset):
             try:
-                # Validar campos requeridos (más eficiente)
-                missing_keys = [key for key in required_keys if key not in row or not row[key]]
-                if missing_keys:
+                # Validar campos requeridos; la lista de faltantes solo se arma si hay alguno
+                if len(row) < width or not all(row[j] for _, j in required):
                     if i < 10:  # Log solo las primeras 10 filas con errores
-                        self.logger.warning(f"Fila {i}: Campos faltantes {missing_keys}")
+                        missing_keys = [key for key, j in required if j >= len(row) or not row[j]]
+                        self.logger.warning("Fila %d: Campos faltantes %s", i, missing_keys)
                     continue
                 
                 # Convertir fecha
-                fecha_str = str(row[date_column]).strip()
+                fecha_str = row[i_fecha].strip()
                 fecha = self._parse_date(fecha_str)
                 
                 if not fecha:
                     if i < 10:  # Log solo las primeras 10 fechas problemáticas
-                        self.logger.warning(f"Fila {i}: Fecha inválida '{fecha_str}'")
+                        self.logger.warning("Fila %d: Fecha inválida '%s'", i, fecha_str)
                     continue
                 
+                # Columnas de baja cardinalidad: sys.intern comparte una sola copia
+                # de cada valor repetido en lugar de una cadena nueva por fila
                 cleaned_row = {
-                    'Cuarto de Hora': int(row['Cuarto de Hora']),
-                    'Barra': row['Barra'].strip(),
-                    'Suministrador': row['Suministrador'].strip(),
-                    'Retiro': row['Retiro'].strip(),
-                    'clave': row['clave'].strip(),
-                    'Tipo': row['Tipo'].strip(),
-                    'Medida_kWh': float(row['Medida_kWh']),
+                    'Cuarto de Hora': int(row[i_cuarto]),
+                    'Barra': sys.intern(row[i_barra].strip()),
+                    'Suministrador': sys.intern(row[i_suministrador].strip()),
+                    'Retiro': sys.intern(row[i_retiro].strip()),
+                    'clave': sys.intern(row[i_clave].strip()),
+                    'Tipo': sys.intern(row[i_tipo].strip()),
+                    'Medida_kWh': float(row[i_medida]),
                     'Clave Año_Mes': fecha  # Estandarizar el nombre
                 }
                 cleaned_data.append(cleaned_row)
                 
-                # Log periódico del progreso
-                if len(cleaned_data) % 100000 == 0:
-                    self.logger.info(f"Retiros validados: {len(cleaned_data)}")
-                
-            except (ValueError, KeyError) as e:
+            except (ValueError, IndexError) as e:
                 if i < 10:  # Log solo los primeros 10 errores
-                    self.logger.warning(f"Fila {i} inválida en retiros: {e}")
+                    self.logger.warning("Fila %d inválida en retiros: %s", i, e)
                 continue
         
-        self.logger.info(f"Datos de retiros validados: {len(cleaned_data)} registros de {len(data)} originales")
+        self.logger.debug("Bloque de retiros validado: %d registros de %d originales", len(cleaned_data), len(data))
         
-        # Mostrar estadísticas de las primeras filas validadas
-        if cleaned_data:
+        # Mostrar estadísticas de las primeras filas validadas (solo en el primer bloque)
+        if cleaned_data and offset == 0:
             self.logger.info("Primeras filas validadas (ejemplo):")
             for i in range(min(3, len(cleaned_data))):
-                self.logger.info(f"Fila {i}: {cleaned_data[i]}")
+                self.logger.info("Fila %d: %s", i, cleaned_data[i])
         
         return cleaned_data
     
     
-    def _validate_contratos_data(self, data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def _validate_contratos_data(self, data: List[List[str]], header: List[str]) -> List[Dict[str, Any]]:
         """Valida y limpia datos de contratos físicos"""
         cleaned_data = []
         
+        # Posición de cada columna, resuelta una vez por bloque
+        index = {name: i for i, name in enumerate(header)}
+        missing = [key for key in _CONTRATOS_COLUMNS if key not in index]
+        if missing:
+            self.logger.error("Columnas faltantes en contratos: %s", missing)
+            return cleaned_data
+        i_cuarto, i_barra, i_clave, i_empresa, i_transaccion, i_kwh, i_valorizado, i_contrato, i_cmg = (
+            index[key] for key in _CONTRATOS_COLUMNS)
+        
         for row in data:
             try:
-                # Validar campos requeridos
-                required_keys = ['Cuarto de Hora', 'Barra', 'clave', 'Empresa', 'TransacciÃ³n', 'Kwhh', 'Valorizado_CLP', 'Id_Contrato', 'CMG_PESO_KWH']
-                if not all(key in row for key in required_keys):
-                    continue
-                
+                # Columnas de baja cardinalidad: una sola copia de cada valor repetido
                 cleaned_row = {
-                    'Cuarto de Hora': int(row['Cuarto de Hora']),
-                    'Barra': row['Barra'].strip(),
-                    'clave': row['clave'].strip(),
-                    'Empresa': row['Empresa'].strip(),
-                    'TransacciÃ³n': row['TransacciÃ³n'].strip(),
-                    'Kwhh': float(row['Kwhh']),
-                    'Valorizado_CLP': float(row['Valorizado_CLP']),
-                    'Id_Contrato': int(row['Id_Contrato']),
-                    'CMG_PESO_KWH': float(row['CMG_PESO_KWH'])
+                    'Cuarto de Hora': int(row[i_cuarto]),
+                    'Barra': sys.intern(row[i_barra].strip()),
+                    'clave': sys.intern(row[i_clave].strip()),
+                    'Empresa': sys.intern(row[i_empresa].strip()),
+                    'TransacciÃ³n': sys.intern(row[i_transaccion].strip()),
+                    'Kwhh': float(row[i_kwh]),
+                    'Valorizado_CLP': float(row[i_valorizado]),
+                    'Id_Contrato': int(row[i_contrato]),
+                    'CMG_PESO_KWH': float(row[i_cmg])
                 }
                 cleaned_data.append(cleaned_row)
                 
-            except (ValueError, KeyError) as e:
-                self.logger.warning(f"Fila inválida en contratos: {e}")
+            except (ValueError, IndexError) as e:
+                self.logger.warning("Fila inválida en contratos: %s", e)
                 continue
         
-        self.logger.info(f"Datos de contratos validados: {len(cleaned_data)} registros")
+        self.logger.debug("Bloque de contratos validado: %d registros", len(cleaned_data))
         return cleaned_data
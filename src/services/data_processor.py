@@ -1,108 +1,137 @@
 import logging
-from typing import List, Dict, Any
+from itertools import islice
+from typing import List, Dict, Any, Iterable, Iterator
 from datetime import datetime, date  # Cambio importante aquí
-from tqdm import tqdm
+
+# Cuarto de hora (1-96) -> (hora, minuto), calculado una sola vez
+_HORA_MINUTO = {cuarto: ((cuarto - 1) // 4, ((cuarto - 1) % 4) * 15) for cuarto in range(1, 97)}
+
+def _trim_columns(columns: Dict[str, List], length: int) -> Dict[str, List]:
+    """Recorta en su lugar las listas reservadas de antemano a las `length` filas escritas"""
+    for values in columns.values():
+        del values[length:]
+    return columns
 
 class SimpleDataProcessor:
     """Procesador de datos optimizado para grandes volúmenes"""
     
-    def __init__(self, data_repository):
+    def __init__(self, data_repository, batch_size: int = 5000):
         self.repository = data_repository
         self.logger = logging.getLogger(__name__)
-        self.batch_size = 5000  # Procesar en lotes de 5000 registros
+        self.batch_size = batch_size  # Registros por lote (5000 por defecto)
     
-    def process_precios_marginales(self, data: List[Dict[str, Any]]) -> int:
+    def process_precios_marginales(self, data: Iterable[Dict[str, Any]], session=None) -> int:
         """Procesa y migra datos de precios marginales en lotes"""
-        self.logger.info("Procesando datos de precios marginales...")
-        
-        if not data:
-            self.logger.warning("No hay datos para procesar")
-            return 0
+        self.logger.debug("Procesando datos de precios marginales...")
         
         total_processed = 0
+        batch_num = 0
         
-        # Procesar en lotes
-        for batch_num, i in enumerate(range(0, len(data), self.batch_size), 1):
-            batch_data = data[i:i + self.batch_size]
-            self.logger.info(f"Procesando lote {batch_num} de precios marginales ({len(batch_data)} registros)")
+        # Procesar en lotes; sirve cualquier iterable, sin materializarlo completo
+        for batch_num, batch_data in enumerate(self._iter_batches(data), 1):
+            self.logger.debug("Procesando lote %d de precios marginales (%d registros)", batch_num, len(batch_data))
             
-            processed_in_batch = self._process_precios_batch(batch_data)
+            processed_in_batch = self._process_precios_batch(batch_data, session)
             total_processed += processed_in_batch
             
-            self.logger.info(f"Lote {batch_num} completado: {processed_in_batch} registros")
+            self.logger.debug("Lote %d completado: %d registros", batch_num, processed_in_batch)
         
-        self.logger.info(f"Total precios marginales procesados: {total_processed}")
+        if not batch_num:
+            self.logger.warning("No hay datos para procesar")
+            return 0
+        
+        self.logger.debug("Total precios marginales procesados en la llamada: %d", total_processed)
         return total_processed
     
-    def _process_precios_batch(self, batch_data: List[Dict[str, Any]]) -> int:
+    def _iter_batches(self, data: Iterable[Dict[str, Any]]) -> Iterator[List[Dict[str, Any]]]:
+        """Agrupa las filas en listas de hasta `batch_size` a medida que se consumen"""
+        rows = iter(data)
+        while batch := list(islice(rows, self.batch_size)):
+            yield batch
+    
+    def _process_precios_batch(self, batch_data: List[Dict[str, Any]], session=None) -> int:
         """Procesa un lote de datos de precios marginales"""
-        # Extraer datos únicos del lote
-        barras_unicas = list(set(row['BARRA'] for row in batch_data))
-        tiempos_data = []
+        # Una sola pasada: barras y tiempos únicos del lote, y la clave de cada fila
+        barras_unicas = {}
+        tiempos_data = {}
+        row_keys = []
         
         for row in batch_data:
-            tiempos_data.append({
-                'fecha': row['FECHA'],
-                'hora': row['HORA'],
-                'minuto': row['MINUTO'],
-                'cuarto_hora': (row['HORA'] * 4) + (row['MINUTO'] // 15)
-            })
+            barra = row['BARRA']
+            tiempo_key = (row['FECHA'], row['HORA'], row['MINUTO'])
+            barras_unicas[barra] = None
+            if tiempo_key not in tiempos_data:
+                tiempos_data[tiempo_key] = {
+                    'fecha': row['FECHA'],
+                    'hora': row['HORA'],
+                    'minuto': row['MINUTO'],
+                    'cuarto_hora': (row['HORA'] * 4) + (row['MINUTO'] // 15)
+                }
+            row_keys.append((tiempo_key, barra))
         
         # Obtener mapeos
-        barras_map = self.repository.barra_repo.insert_or_get_barras(barras_unicas)
-        tiempos_map = self.repository.tiempo_repo.insert_or_get_tiempos(tiempos_data)
+        barras_map, tiempos_map = self.repository.resolve_dims(list(barras_unicas), list(tiempos_data.values()), session=session)
         
-        # Preparar datos para inserción
-        precios_to_insert = []
+        # Preparar datos para inserción: una lista por columna, reservada con el
+        # tamaño del lote y recortada al final; los .get se enlazan a nombres
+        # locales para no buscarlos en cada fila
+        tiempo_get = tiempos_map.get
+        barra_get = barras_map.get
+        n = len(batch_data)
+        k = 0
+        tiempo_ids, barra_ids, cmg_mills, cmg_usd, usd = ([None] * n for _ in range(5))
         
-        for row in batch_data:
-            tiempo_key = (row['FECHA'], row['HORA'], row['MINUTO'])
-            tiempo_id = tiempos_map.get(tiempo_key)
-            barra_id = barras_map.get(row['BARRA'])
+        for row, (tiempo_key, barra) in zip(batch_data, row_keys):
+            tiempo_id = tiempo_get(tiempo_key)
+            barra_id = barra_get(barra)
             
             if tiempo_id and barra_id:
-                precios_to_insert.append({
-                    'tiempo_id': tiempo_id,
-                    'barra_id': barra_id,
-                    'cmg_mills_kwh': row['CMg[mills/kWh]'],
-                    'cmg_usd_kwh': row['CMg[$/KWh]'],
-                    'usd': row['USD']
-                })
+                tiempo_ids[k] = tiempo_id
+                barra_ids[k] = barra_id
+                cmg_mills[k] = row['CMg[mills/kWh]']
+                cmg_usd[k] = row['CMg[$/KWh]']
+                usd[k] = row['USD']
+                k += 1
+        
+        precios_to_insert = _trim_columns({'tiempo_id': tiempo_ids, 'barra_id': barra_ids, 'cmg_mills_kwh': cmg_mills, 'cmg_usd_kwh': cmg_usd, 'usd': usd}, k)
         
         # Insertar datos del lote
-        if precios_to_insert:
-            return self.repository.insert_precios_marginales(precios_to_insert)
+        if precios_to_insert['tiempo_id']:
+            return self.repository.insert_precios_marginales(precios_to_insert, session=session)
         return 0
     
-    def process_retiros_energia(self, data: List[Dict[str, Any]]) -> int:
+    def process_retiros_energia(self, data: Iterable[Dict[str, Any]], session=None) -> int:
         """Procesa y migra datos de retiros de energía en lotes"""
-        self.logger.info("Procesando datos de retiros de energía...")
-        
-        if not data:
-            self.logger.warning("No hay datos para procesar")
-            return 0
+        self.logger.debug("Procesando datos de retiros de energía...")
         
         total_processed = 0
+        batch_num = 0
         
-        # Procesar en lotes
-        for batch_num, i in enumerate(range(0, len(data), self.batch_size), 1):
-            batch_data = data[i:i + self.batch_size]
-            self.logger.info(f"Procesando lote {batch_num} de retiros ({len(batch_data)} registros)")
+        # Procesar en lotes; sirve cualquier iterable, sin materializarlo completo
+        for batch_num, batch_data in enumerate(self._iter_batches(data), 1):
+            self.logger.debug("Procesando lote %d de retiros (%d registros)", batch_num, len(batch_data))
             
-            processed_in_batch = self._process_retiros_batch(batch_data)
+            processed_in_batch = self._process_retiros_batch(batch_data, session)
             total_processed += processed_in_batch
             
-            self.logger.info(f"Lote {batch_num} completado: {processed_in_batch} registros")
+            self.logger.debug("Lote %d completado: %d registros", batch_num, processed_in_batch)
         
-        self.logger.info(f"Total retiros procesados: {total_processed}")
+        if not batch_num:
+            self.logger.warning("No hay datos para procesar")
+            return 0
+        
+        self.logger.debug("Total retiros procesados en la llamada: %d", total_processed)
         return total_processed
     
-    def _process_retiros_batch(self, batch_data: List[Dict[str, Any]]) -> int:
+    def _process_retiros_batch(self, batch_data: List[Dict[str, Any]], session=None) -> int:
         """Procesa un lote de datos de retiros de energía"""
-        # Extraer datos únicos del lote
-        barras_unicas = list(set(row['Barra'] for row in batch_data))
+        # Una sola pasada: barras y tiempos únicos del lote, y la clave de cada fila
+        # (None si la fecha no es válida y la fila se descarta)
+        barras_unicas = {}
+        tiempos_data = {}
+        row_keys = []
+        claves_anio_mes = {}  # fecha -> 'YYYY-MM', una vez por fecha distinta
         
-        tiempos_data = []
         for row in batch_data:
             
             # Asegurarse de que la fecha está parseada correctamente
@@ -110,120 +139,154 @@ class SimpleDataProcessor:
             
             # CORRECCIÓN: Usar 'date' en lugar de 'datetime.date'
             if not isinstance(fecha, date):
-                self.logger.warning(f"Fecha no parseada correctamente: {fecha}")
+                self.logger.warning("Fecha no parseada correctamente: %s", fecha)
+                row_keys.append(None)
                 continue
             
-            tiempos_data.append({
-                'fecha': fecha,
-                'hora': (row['Cuarto de Hora'] - 1) // 4,
-                'minuto': ((row['Cuarto de Hora'] - 1) % 4) * 15,
-                'cuarto_hora': row['Cuarto de Hora'],
-                'clave_anio_mes': fecha.strftime('%Y-%m')
-            })
+            barra = row['Barra']
+            cuarto_hora = row['Cuarto de Hora']
+            try:
+                hora, minuto = _HORA_MINUTO[cuarto_hora]
+            except KeyError:  # Fuera de 1-96: mismo cálculo que antes
+                hora, minuto = (cuarto_hora - 1) // 4, ((cuarto_hora - 1) % 4) * 15
+            tiempo_key = (fecha, hora, minuto)
+            
+            clave_anio_mes = claves_anio_mes.get(fecha)
+            if clave_anio_mes is None:
+                clave_anio_mes = claves_anio_mes[fecha] = f"{fecha.year:04d}-{fecha.month:02d}"
+            
+            barras_unicas[barra] = None
+            if tiempo_key not in tiempos_data:
+                tiempos_data[tiempo_key] = {
+                    'fecha': fecha,
+                    'hora': hora,
+                    'minuto': minuto,
+                    'cuarto_hora': cuarto_hora,
+                    'clave_anio_mes': clave_anio_mes
+                }
+            row_keys.append((tiempo_key, barra, clave_anio_mes))
         
         # Obtener mapeos
-        barras_map = self.repository.barra_repo.insert_or_get_barras(barras_unicas)
-        tiempos_map = self.repository.tiempo_repo.insert_or_get_tiempos(tiempos_data)
+        barras_map, tiempos_map = self.repository.resolve_dims(list(barras_unicas), list(tiempos_data.values()), session=session)
         
-        # Preparar datos para inserción
-        retiros_to_insert = []
+        # Preparar datos para inserción: una lista por columna, reservada con el
+        # tamaño del lote y recortada al final; los .get se enlazan a nombres
+        # locales para no buscarlos en cada fila
+        tiempo_get = tiempos_map.get
+        barra_get = barras_map.get
+        n = len(batch_data)
+        k = 0
+        tiempo_ids, barra_ids, suministradores, retiros, claves, tipos, claves_am, medidas = ([None] * n for _ in range(8))
         
-        for row in batch_data:
-            fecha = row.get('Clave Año_Mes') or row.get('Clave AÃ±o_Mes')
-            # CORRECCIÓN: Usar 'date' en lugar de 'datetime.date'
-            if not isinstance(fecha, date):
+        for row, keys in zip(batch_data, row_keys):
+            if keys is None:
                 continue
+            tiempo_key, barra, clave_anio_mes = keys
             
-            hora = (row['Cuarto de Hora'] - 1) // 4
-            minuto = ((row['Cuarto de Hora'] - 1) % 4) * 15
-            tiempo_key = (fecha, hora, minuto)
+            tiempo_id = tiempo_get(tiempo_key)
+            barra_id = barra_get(barra)
             
-            tiempo_id = tiempos_map.get(tiempo_key)
-            barra_id = barras_map.get(row['Barra'])
-            
-            if all([tiempo_id, barra_id]):
-                retiros_to_insert.append({
-                    'tiempo_id': tiempo_id,
-                    'barra_id': barra_id,
-                    'suministrador': row['Suministrador'],
-                    'retiro': row['Retiro'],
-                    'clave': row['clave'],
-                    'tipo': row['Tipo'],
-                    'clave_anio_mes': fecha.strftime('%Y-%m'),
-                    'medida_kwh': row['Medida_kWh']
-                })
+            if tiempo_id and barra_id:
+                tiempo_ids[k] = tiempo_id
+                barra_ids[k] = barra_id
+                suministradores[k] = row['Suministrador']
+                retiros[k] = row['Retiro']
+                claves[k] = row['clave']
+                tipos[k] = row['Tipo']
+                claves_am[k] = clave_anio_mes
+                medidas[k] = row['Medida_kWh']
+                k += 1
+        
+        retiros_to_insert = _trim_columns({'tiempo_id': tiempo_ids, 'barra_id': barra_ids, 'suministrador': suministradores, 'retiro': retiros, 'clave': claves, 'tipo': tipos, 'clave_anio_mes': claves_am, 'medida_kwh': medidas}, k)
         
         # Insertar datos del lote
-        if retiros_to_insert:
-            return self.repository.insert_retiros_energia(retiros_to_insert)
+        if retiros_to_insert['tiempo_id']:
+            return self.repository.insert_retiros_energia(retiros_to_insert, session=session)
         return 0
     
-    def process_contratos_fisicos(self, data: List[Dict[str, Any]]) -> int:
+    def process_contratos_fisicos(self, data: Iterable[Dict[str, Any]], session=None) -> int:
         """Procesa y migra datos de contratos físicos en lotes"""
-        self.logger.info("Procesando datos de contratos físicos...")
-        
-        if not data:
-            self.logger.warning("No hay datos para procesar")
-            return 0
+        self.logger.debug("Procesando datos de contratos físicos...")
         
         total_processed = 0
+        batch_num = 0
+        # Misma fecha para todos los lotes de la llamada, aunque pase la medianoche
+        hoy = datetime.now().date()
         
-        # Procesar en lotes
-        for batch_num, i in enumerate(range(0, len(data), self.batch_size), 1):
-            batch_data = data[i:i + self.batch_size]
-            self.logger.info(f"Procesando lote {batch_num} de contratos ({len(batch_data)} registros)")
+        # Procesar en lotes; sirve cualquier iterable, sin materializarlo completo
+        for batch_num, batch_data in enumerate(self._iter_batches(data), 1):
+            self.logger.debug("Procesando lote %d de contratos (%d registros)", batch_num, len(batch_data))
             
-            processed_in_batch = self._process_contratos_batch(batch_data)
+            processed_in_batch = self._process_contratos_batch(batch_data, session, hoy)
             total_processed += processed_in_batch
             
-            self.logger.info(f"Lote {batch_num} completado: {processed_in_batch} registros")
+            self.logger.debug("Lote %d completado: %d registros", batch_num, processed_in_batch)
+        
+        if not batch_num:
+            self.logger.warning("No hay datos para procesar")
+            return 0
         
-        self.logger.info(f"Total contratos procesados: {total_processed}")
+        self.logger.debug("Total contratos procesados en la llamada: %d", total_processed)
         return total_processed
     
-    def _process_contratos_batch(self, batch_data: List[Dict[str, Any]]) -> int:
+    def _process_contratos_batch(self, batch_data: List[Dict[str, Any]], session=None, hoy: date = None) -> int:
         """Procesa un lote de datos de contratos físicos"""
-        # Extraer datos únicos del lote
-        barras_unicas = list(set(row['Barra'] for row in batch_data))
+        # Una sola pasada: barras y tiempos únicos del lote, y la clave de cada fila
+        barras_unicas = {}
+        tiempos_data = {}
+        row_keys = []
+        hoy = hoy or datetime.now().date()  # Una vez por lote, no por fila
         
-        tiempos_data = []
         for row in batch_data:
-            tiempos_data.append({
-                'fecha': datetime.now().date(),
-                'hora': (row['Cuarto de Hora'] - 1) // 4,
-                'minuto': ((row['Cuarto de Hora'] - 1) % 4) * 15,
-                'cuarto_hora': row['Cuarto de Hora']
-            })
+            barra = row['Barra']
+            cuarto_hora = row['Cuarto de Hora']
+            try:
+                hora, minuto = _HORA_MINUTO[cuarto_hora]
+            except KeyError:  # Fuera de 1-96: mismo cálculo que antes
+                hora, minuto = (cuarto_hora - 1) // 4, ((cuarto_hora - 1) % 4) * 15
+            tiempo_key = (hoy, hora, minuto)
+            
+            barras_unicas[barra] = None
+            if tiempo_key not in tiempos_data:
+                tiempos_data[tiempo_key] = {
+                    'fecha': hoy,
+                    'hora': hora,
+                    'minuto': minuto,
+                    'cuarto_hora': cuarto_hora
+                }
+            row_keys.append((tiempo_key, barra))
         
         # Obtener mapeos
-        barras_map = self.repository.barra_repo.insert_or_get_barras(barras_unicas)
-        tiempos_map = self.repository.tiempo_repo.insert_or_get_tiempos(tiempos_data)
+        barras_map, tiempos_map = self.repository.resolve_dims(list(barras_unicas), list(tiempos_data.values()), session=session)
         
-        # Preparar datos para inserción
-        contratos_to_insert = []
+        # Preparar datos para inserción: una lista por columna, reservada con el
+        # tamaño del lote y recortada al final; los .get se enlazan a nombres
+        # locales para no buscarlos en cada fila
+        tiempo_get = tiempos_map.get
+        barra_get = barras_map.get
+        n = len(batch_data)
+        k = 0
+        tiempo_ids, barra_ids, claves, empresas, transacciones, kwhs, valorizados, id_contratos, cmgs = ([None] * n for _ in range(9))
         
-        for row in batch_data:
-            hora = (row['Cuarto de Hora'] - 1) // 4
-            minuto = ((row['Cuarto de Hora'] - 1) % 4) * 15
-            tiempo_key = (datetime.now().date(), hora, minuto)
-            
-            tiempo_id = tiempos_map.get(tiempo_key)
-            barra_id = barras_map.get(row['Barra'])
-            
-            if all([tiempo_id, barra_id]):
-                contratos_to_insert.append({
-                    'tiempo_id': tiempo_id,
-                    'barra_id': barra_id,
-                    'clave': row['clave'],
-                    'nom_empresa': row['Empresa'],
-                    'transaccion': row['TransacciÃ³n'],
-                    'kwh': row['Kwhh'],
-                    'valorizado_clp': row['Valorizado_CLP'],
-                    'id_contrato': row['Id_Contrato'],
-                    'cmg_peso_kwh': row['CMG_PESO_KWH']
-                })
+        for row, (tiempo_key, barra) in zip(batch_data, row_keys):
+            tiempo_id = tiempo_get(tiempo_key)
+            barra_id = barra_get(barra)
+            
+            if tiempo_id and barra_id:
+                tiempo_ids[k] = tiempo_id
+                barra_ids[k] = barra_id
+                claves[k] = row['clave']
+                empresas[k] = row['Empresa']
+                transacciones[k] = row['TransacciÃ³n']
+                kwhs[k] = row['Kwhh']
+                valorizados[k] = row['Valorizado_CLP']
+                id_contratos[k] = row['Id_Contrato']
+                cmgs[k] = row['CMG_PESO_KWH']
+                k += 1
+        
+        contratos_to_insert = _trim_columns({'tiempo_id': tiempo_ids, 'barra_id': barra_ids, 'clave': claves, 'nom_empresa': empresas, 'transaccion': transacciones, 'kwh': kwhs, 'valorizado_clp': valorizados, 'id_contrato': id_contratos, 'cmg_peso_kwh': cmgs}, k)
         
         # Insertar datos del lote
-        if contratos_to_insert:
-            return self.repository.insert_contratos_fisicos(contratos_to_insert)
+        if contratos_to_insert['tiempo_id']:
+            return self.repository.insert_contratos_fisicos(contratos_to_insert, session=session)
         return 0
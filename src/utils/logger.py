@@ -1,16 +1,40 @@
+import atexit
 import logging
+import queue
 import sys
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict
 import os
 
+# Archivo de log del proceso: se fija en la primera llamada y lo comparten todos los loggers
+_LOG_FILE = None
+
+# Hilo de escritura de cada logger configurado por setup_logger, por nombre de logger
+_LISTENERS: Dict[str, QueueListener] = {}
+
+def _get_log_file() -> str:
+    """Retorna la ruta del archivo de log del proceso, creando el directorio la primera vez"""
+    global _LOG_FILE
+    if _LOG_FILE is None:
+        log_dir = "logs"
+        os.makedirs(log_dir, exist_ok=True)
+        _LOG_FILE = os.path.join(log_dir, f"migracion_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
+    return _LOG_FILE
+
+def _stop_listeners():
+    """Vacía las colas pendientes y detiene los hilos de escritura al terminar el proceso"""
+    while _LISTENERS:
+        _, listener = _LISTENERS.popitem()
+        listener.stop()
+
+atexit.register(_stop_listeners)
+
 def setup_logger(name: str) -> logging.Logger:
     """Configura y retorna un logger"""
     
-    # Crear directorio de logs si no existe
-    log_dir = "logs"
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-    
     # Configurar logger
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
@@ -27,12 +51,27 @@ def setup_logger(name: str) -> logging.Logger:
     # Handler para consola
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
     
-    # Handler para archivo
-    log_file = os.path.join(log_dir, f"migracion_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+    # Handler para archivo: el mismo para todos los módulos del proceso
+    file_handler = logging.FileHandler(_get_log_file(), encoding='utf-8')
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+    
+    # La escritura en consola y disco ocurre en un hilo aparte: quien registra
+    # solo encola el mensaje y vuelve de inmediato
+    log_queue = queue.Queue(-1)
+    logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    # Al terminar el proceso _stop_listeners vacía la cola antes de cerrar los archivos
+    _LISTENERS[name] = listener
     
     return logger
+
+@contextmanager
+def timed(name: str, logger: logging.Logger):
+    """Registra en el logger la duración del bloque, medida con un reloj monotónico"""
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        logger.info(f"{name} en {(time.perf_counter_ns() - start) / 1e9:.3f}s")
@@ -1,7 +1,25 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import logging
 
+# Formatos de fecha aceptados, en orden de prioridad
+DATE_FORMATS = [
+    '%Y%m%d',        # 20241004
+    '%Y-%m-%d',      # 2024-10-04
+    '%d/%m/%Y',      # 04/10/2024
+    '%m/%d/%Y',      # 10/04/2024
+    '%d-%m-%Y',      # 04-10-2024
+    '%Y/%m/%d',      # 2024/10/04
+]
+
+# Columnas enteras de rango conocido y el tipo explícito al que se convierten; int16
+# y no el mínimo posible (int8) para que la aritmética posterior no desborde
+INTEGER_COLUMNS = {'HORA': 'int16', 'MINUTO': 'int16', 'Cuarto de Hora': 'int16', 'Id_Contrato': 'int32'}
+
+# Columnas de texto con pocos valores distintos que se repiten en millones de filas
+CATEGORY_COLUMNS = ('BARRA', 'Barra', 'Empresa', 'Suministrador', 'Retiro', 'Tipo', 'TransacciÃ³n')
+
 class DataValidator:
     """Validador de datos para la migración"""
     
@@ -10,18 +28,7 @@ class DataValidator:
 
     def _parse_date_flexible(self, date_str):
         """Parsea fechas en diferentes formatos para pandas"""
-        from datetime import datetime
-        
-        date_formats = [
-            '%Y%m%d',        # 20241004
-            '%Y-%m-%d',      # 2024-10-04
-            '%d/%m/%Y',      # 04/10/2024
-            '%m/%d/%Y',      # 10/04/2024
-            '%d-%m-%Y',      # 04-10-2024
-            '%Y/%m/%d',      # 2024/10/04
-        ]
-        
-        for fmt in date_formats:
+        for fmt in DATE_FORMATS:
             try:
                 return datetime.strptime(str(date_str), fmt).date()
             except ValueError:
@@ -29,6 +36,45 @@ class DataValidator:
         
         return None
     
+    def _parse_dates_flexible(self, values: pd.Series) -> pd.Series:
+        """Versión vectorizada de _parse_date_flexible para una columna completa"""
+        strings = values.astype(str)
+        
+        # Cada formato se prueba de una vez sobre los valores distintos que aún no se resolvieron
+        uniques = pd.Series(strings.unique())
+        parsed = pd.Series(pd.NaT, index=uniques.index, dtype='datetime64[ns]')
+        for fmt in DATE_FORMATS:
+            pending = parsed.isna()
+            if not pending.any():
+                break
+            parsed[pending] = pd.to_datetime(uniques[pending], format=fmt, errors='coerce')
+        
+        fechas = parsed.dt.date.astype(object).where(parsed.notna(), None)
+        
+        # pandas es más estricto que strptime (anchos fijos, años hasta 2262): lo que
+        # quedó sin resolver se revisa valor a valor para conservar el resultado original
+        pending = parsed.isna()
+        fechas[pending] = uniques[pending].map(self._parse_date_flexible)
+        return strings.map(dict(zip(uniques, fechas)))
+    
+    def _to_integers(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Convierte las columnas de INTEGER_COLUMNS a su tipo si no tienen nulos, decimales ni valores fuera de rango"""
+        for col, dtype in INTEGER_COLUMNS.items():
+            if col in df.columns:
+                values = df[col]
+                info = np.iinfo(dtype)
+                # Con algún valor que no cabe la columna queda como la dejó pd.to_numeric
+                if values.notna().all() and (values % 1 == 0).all() and values.between(info.min, info.max).all():
+                    df[col] = values.astype(dtype)
+        return df
+    
+    def _to_categories(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Guarda las columnas de baja cardinalidad como category: un código por fila y cada texto una vez"""
+        for col in CATEGORY_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype('category')
+        return df
+    
     def validate_precio_marginal_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """Valida y limpia datos de precio marginal con formato de fecha flexible"""
         required_columns = ['FECHA', 'HORA', 'MINUTO', 'BARRA', 'CMg[mills/kWh]', 'CMg[$/KWh]', 'USD']
@@ -38,13 +84,14 @@ class DataValidator:
         if missing_columns:
             raise ValueError(f"Columnas faltantes en precio marginal: {missing_columns}")
         
-        # Limpiar datos
-        df_clean = df.copy()
+        # Limpiar datos: copia superficial, las columnas convertidas se reemplazan
+        # y el resto comparte memoria con `df`, que no se modifica
+        df_clean = df.copy(deep=False)
         
         # Convertir fecha con formato flexible
-        df_clean['FECHA'] = df_clean['FECHA'].apply(self._parse_date_flexible)
+        df_clean['FECHA'] = self._parse_dates_flexible(df_clean['FECHA'])
         
-        # Convertir otros tipos de datos
+        # Convertir otros tipos de datos; los montos siguen en float64
         df_clean['HORA'] = pd.to_numeric(df_clean['HORA'], errors='coerce')
         df_clean['MINUTO'] = pd.to_numeric(df_clean['MINUTO'], errors='coerce')
         df_clean['CMg[mills/kWh]'] = pd.to_numeric(df_clean['CMg[mills/kWh]'], errors='coerce')
@@ -59,7 +106,7 @@ class DataValidator:
         if initial_count != final_count:
             self.logger.warning(f"Se eliminaron {initial_count - final_count} filas con datos inválidos en precio marginal")
         
-        return df_clean
+        return self._to_categories(self._to_integers(df_clean))
 
 
     def validate_retiros_data(self, df: pd.DataFrame) -> pd.DataFrame:
@@ -70,7 +117,7 @@ class DataValidator:
         if missing_columns:
             raise ValueError(f"Columnas faltantes en retiros: {missing_columns}")
         
-        df_clean = df.copy()
+        df_clean = df.copy(deep=False)  # Solo se reemplazan columnas; `df` no se modifica
         
         # Convertir tipos de datos
         df_clean['Cuarto de Hora'] = pd.to_numeric(df_clean['Cuarto de Hora'], errors='coerce')
@@ -85,7 +132,7 @@ class DataValidator:
         if initial_count != final_count:
             self.logger.warning(f"Se eliminaron {initial_count - final_count} filas con datos inválidos en retiros")
         
-        return df_clean
+        return self._to_categories(self._to_integers(df_clean))
     
     def validate_contratos_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """Valida y limpia datos de contratos físicos"""
@@ -96,7 +143,7 @@ class DataValidator:
         if missing_columns:
             raise ValueError(f"Columnas faltantes en contratos: {missing_columns}")
         
-        df_clean = df.copy()
+        df_clean = df.copy(deep=False)  # Solo se reemplazan columnas; `df` no se modifica
         
         # Convertir tipos de datos
         df_clean['Cuarto de Hora'] = pd.to_numeric(df_clean['Cuarto de Hora'], errors='coerce')
@@ -113,4 +160,4 @@ class DataValidator:
         if initial_count != final_count:
             self.logger.warning(f"Se eliminaron {initial_count - final_count} filas con datos inválidos en contratos")
         
-        return df_clean
+        return self._to_categories(self._to_integers(df_clean))